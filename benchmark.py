@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+# TuyaPower (Tuya Power Stats)
+#      Benchmark - Broadcast decode and frame parsing speed in packets per second
+#
+# Author: Jason A. Cox
+# For more information see https://github.com/jasonacox/tuyapower
+
+from __future__ import print_function   # python 2.7 support
+import binascii
+import json
+import struct
+import sys
+import time
+from hashlib import md5
+
+from Crypto.Cipher import AES
+
+import tuyapower
+from tuyapower import protocol
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) >= 2 else 2.0
+KEY = b"0123456789abcdef"
+CHUNK = 1460    # TCP segment size the stream is split into
+
+def sample(vers):
+    body = json.dumps({"ip": "10.0.1.99", "gwId": "01234567891234567890", "active": 2,
+        "ability": 0, "mode": 0, "encrypt": vers != "3.1", "productKey": "keyabcdefghijklm",
+        "version": vers})
+    if vers == "3.5":
+        return protocol.pack_message(0, 0x13, body.encode(), tuyapower.udpkey, protocol.PREFIX_6699)
+    if vers == "3.1":
+        return protocol.pack_message(0, 0x13, b"\x00" * 4 + body.encode())
+    return protocol.pack_message(0, 0x13, b"\x00" * 4 + tuyapower.encrypt(body, tuyapower.udpkey))
+
+# decode path before the cached cipher - new AES object per packet, try decrypt first
+udpkey = md5(b"yGAdlopoPVldABfn").digest()
+def legacy(data, ip):
+    result = data[20:-8]
+    try:
+        result = tuyapower.unpad(AES.new(udpkey, AES.MODE_ECB).decrypt(result)).decode()
+    except:
+        result = result.decode()
+    return json.loads(result)
+
+# stream of DPS responses as a device sends them - 3.3 frames with a return code
+def stream(count):
+    session = protocol.Session("01234567891234567890", KEY, "3.3")
+    dps = {"dps": {"1": True, "18": 123, "19": 456, "20": 1201}}
+    frames = [protocol.pack_message(i, protocol.DP_QUERY, b"\x00" * 4 + session.version_header
+        + protocol.encrypt_ecb(KEY, json.dumps(dps).encode())) for i in range(count)]
+    data = b"".join(bytes(f) for f in frames)
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+# stream framing before FrameParser - copy each frame out of the buffer, then
+# slice the return code, payload and checksum out of the copy
+def legacyStream(chunks):
+    (buf, count) = (bytearray(), 0)
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= protocol.HEADER_55AA_LEN:
+            header = protocol.parse_header(bytes(buf[:protocol.HEADER_55AA_LEN]))
+            if len(buf) < header.total:
+                break
+            frame = bytes(buf[:header.total])
+            del buf[:header.total]
+            end = header.total - 8
+            rc = struct.unpack(">I", frame[16:20])[0]
+            payload = frame[20:end]
+            crc_good = struct.unpack(">I", frame[end:end + 4])[0] == binascii.crc32(frame[:end]) & 0xFFFFFFFF
+            msg = protocol.Message(header.seqno, header.cmd, rc, payload, crc_good, header.prefix)
+            if msg.crc_good and msg.payload:
+                count += 1
+    return count
+
+def parserStream(chunks):
+    (parser, count) = (protocol.FrameParser(), 0)
+    for chunk in chunks:
+        for (frame, header) in parser.feed(chunk):
+            msg = protocol.unpack_message(frame, None, header)
+            if msg.crc_good and msg.payload:
+                count += 1
+    return count
+
+def rate(decode, data):
+    count = 0
+    start = time.time()
+    while time.time() - start < SECONDS:
+        for i in range(1000):
+            decode(data, "10.0.1.99")
+        count += 1000
+    return count / (time.time() - start)
+
+def streamRate(parse, chunks):
+    count = 0
+    start = time.time()
+    while time.time() - start < SECONDS:
+        count += parse(chunks)
+    return count / (time.time() - start)
+
+print("TuyaPower (Tuya Power Stats) [%s] %s [%s]"%(tuyapower.__version__,tuyapower.api,tuyapower.api_ver))
+print("Broadcast decode and frame parsing - packets per second (%ss each)\n" % SECONDS)
+print("%-22s %12s %12s %8s" % ("Payload", "before", "after", "speedup"))
+for (name, vers) in (("3.1 plaintext", "3.1"), ("3.3 encrypted", "3.3"), ("3.5 GCM", "3.5")):
+    data = bytes(sample(vers))
+    assert tuyapower._decodeBroadcast(data, "10.0.1.99")[1] == "Valid"
+    after = rate(tuyapower._decodeBroadcast, data)
+    if vers == "3.5":
+        # 6699 frames were not decoded before
+        print("%-22s %12s %12.0f %8s" % (name, "-", after, "-"))
+        continue
+    before = rate(legacy, data)
+    print("%-22s %12.0f %12.0f %7.1fx" % (name, before, after, after / before))
+
+chunks = stream(1000)
+assert legacyStream(chunks) == parserStream(chunks) == 1000
+before = streamRate(legacyStream, chunks)
+after = streamRate(parserStream, chunks)
+print("%-22s %12.0f %12.0f %7.1fx" % ("TCP stream (CRC)", before, after, after / before))
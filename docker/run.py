@@ -4,8 +4,10 @@
 #      Power Probe - Wattage of smartplugs
 
 import datetime
+import json
 import os
 import sys
+from collections import OrderedDict
 
 import tuyapower
 
@@ -45,15 +47,14 @@ PLUGJSON = os.getenv("PLUGJSON", DEVICEJSON).lower()=="yes"
 now = datetime.datetime.utcnow()
 iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-# Poll Smart Device for Raw  Data
-(raw) = tuyapower.deviceRaw(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
-# Poll Smart Switch for Power Data
-(on, w, mA, V, err) = tuyapower.deviceInfo(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+# Poll Smart Device for Power Data and Raw Response (single request)
+status = tuyapower.deviceStatus(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+(on, w, mA, V, err) = status[:5]
+raw = status.raw
 
-# Compute projected kWh
-day = (w / 1000.0) * 24
-week = 7.0 * day
-month = (week * 52.0) / 12.0
+# Projected kWh - assumes the load stays at the current draw,
+# see tuyapower.EnergyMeter to integrate real usage over time
+(day, week, month) = tuyapower.projection(w)
 
 # Print Output
 if not PLUGJSON:
@@ -69,13 +70,10 @@ if not PLUGJSON:
         print("    Power (W): %f" % w)
         print("    Current (mA): %f" % mA)
         print("    Voltage (V): %f" % V)
-        print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f" % (day,week,month))
+        print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f (at current draw)" % (day,week,month))
     else:
         print("    NOTE: %s" % err)
     print("")
 else: 
     # Print json output
-    print(
-        '{ "datetime": "%s", "switch": "%s", "power": "%s", "current": "%s", "voltage": "%s" }'
-        % (iso_time, on, w, mA, V)
-    )
+    print(json.dumps(OrderedDict([("datetime", iso_time), ("switch", on), ("power", w), ("current", mA), ("voltage", V)])))
@@ -6,8 +6,8 @@
  For more information see https://github.com/jasonacox/tuyapower
 
  This example script reads a JSON file (devices.json) to get name, device ID and device key
- for a set of smart devices to poll.  It will use the tuyapower network scanning function to discover
- the IP address for these devices.  It will then loop through each device and display state (on/off) 
+ for a set of smart devices to poll.  It will use a tuyapower DeviceRegistry to listen for device
+ broadcasts and look up the IP address for these devices.  It will then poll all devices concurrently and display state (on/off)
  and any power data that may be available (for devices that monitor power).
 
  The devices.json file can be created from the output of the "tuya-cli wizard" command to 
@@ -15,11 +15,10 @@
  the tuyapower [README](../README.md). You can also watch this great 'Tech With Eddie YouTube tutorial
  that will walk you through getting your Tuya device keys: https://youtu.be/oq0JL_wicKg
 
- Note: the output of the "tuya-cli wizard" command is improperly formatted JSON. I'm using the
- demjson module to read the dirty JSON so that you can simply copy and paste the output from the
- "tuya-cli wizard" command.
+ Note: the output of the "tuya-cli wizard" command is improperly formatted JSON. tuyapower.Fleet
+ reads it anyway (strict JSON is tried first) so that you can simply copy and paste the output
+ from the "tuya-cli wizard" command.
 """
-import demjson
 import tuyapower
 
 # Terminal Color Formatting
@@ -32,31 +31,28 @@ alertdim="\033[0m\033[91m\033[2m"
 
 # Load Device Keys from Tuya JSON file
 print("Loading Tuya Keys...")
-f = open('devices.json',"r")
-data = demjson.decode(f.read())
-f.close()
-print("    %s%s device keys loaded%s"%(dim,len(data),normal))
+fleet = tuyapower.Fleet.load('devices.json')
+print("    %s%s device keys loaded%s"%(dim,len(fleet),normal))
 print()
 
-print("Scanning network for Tuya devices...")
-devices = tuyapower.deviceScan(False,20)
-print("    %s%s devices found%s"%(dim,len(devices),normal))
+print("Listening for Tuya device broadcasts...")
+registry = tuyapower.DeviceRegistry()
+registry.start()
+registry.wait([device.id for device in fleet], timeout=20)
+print("    %s%s devices found%s"%(dim,len(registry),normal))
 print()
 
-def getIP(d, gwid):
-    for ip in d:
-        if (gwid == d[ip]['gwId']):
-            return (ip,d[ip]['version'])
-    return (0,0)
-
 print("Polling devices...")
-for i in data:
-        name = i['name'] 
-        (ip,ver) = getIP(devices, i['id'])
-        if (ip == 0):
+fleet.join(registry.devices())
+results = tuyapower.deviceInfoMany(fleet.targets())
+
+for device in fleet:
+        name = device.name
+        ip = device.ip
+        if device.id not in results:
             print ('%s[%s]%s - %sError - No IP found%s'%(bold,name,dim,alert,normal))
         else:
-            (on, w, mA, V, err) = tuyapower.deviceInfo(i['id'], ip, i['key'], ver)
+            (on, w, mA, V, err) = results[device.id]
             state = alertdim + "Off" + dim
             if isinstance(on,dict):
                 state = dim + "%d Switches: " % len(on)
@@ -72,4 +68,5 @@ for i in data:
             else:
                 print("%s[%s - %s]%s - %s"%(bold,name,ip,dim,state))
 
-print()
\ No newline at end of file
+print()
+registry.stop()
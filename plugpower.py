@@ -36,15 +36,14 @@ PLUGVERS = os.getenv("PLUGVERS", DEVICEVERS)
 now = datetime.datetime.utcnow()
 iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-# Poll Smart Device for Raw  Data
-(raw) = tuyapower.deviceRaw(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
-# Poll Smart Switch for Power Data
-(on, w, mA, V, err) = tuyapower.deviceInfo(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+# Poll Smart Device for Power Data and Raw Response (single request)
+status = tuyapower.deviceStatus(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+(on, w, mA, V, err) = status[:5]
+raw = status.raw
 
-# Compute projected kWh
-day = (w / 1000.0) * 24
-week = 7.0 * day
-month = (week * 52.0) / 12.0
+# Projected kWh - assumes the load stays at the current draw,
+# see tuyapower.EnergyMeter to integrate real usage over time
+(day, week, month) = tuyapower.projection(w)
 
 # Print Output
 print("TuyaPower (Tuya Power Stats) [%s] %s [%s]"%(tuyapower.__version__,tuyapower.api,tuyapower.api_ver))
@@ -58,7 +57,7 @@ if err == "OK":
     print("    Power (W): %f" % w)
     print("    Current (mA): %f" % mA)
     print("    Voltage (V): %f" % V)
-    print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f" % (day,week,month))
+    print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f (at current draw)" % (day,week,month))
 else:
     print("    NOTE: %s" % err)
 
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+#
+# TuyaPower (Tuya Power Stats)
+#      Circuit Breaker Test - deviceInfo() with the breaker off, open and reset without a device
+#
+# Usage: python test-breaker.py
+
+from __future__ import print_function   # python 2.7 support
+import socket
+import sys
+
+import tuyapower
+
+PLUGID = "01234567891234567890"
+DPS = {"1": True, "18": 100, "19": 123, "20": 1200}
+
+polls = []
+online = [False]
+failed = 0
+
+
+# stands in for the device connection - counts the polls that reach the network
+def status(deviceid, ip, key, vers, timeout=None):
+    polls.append(deviceid)
+    if not online[0]:
+        raise socket.error("No route to host")
+    return {"dps": dict(DPS)}
+
+
+def check(name, polled, err):
+    global failed
+    before = len(polls)
+    (on, w, mA, V, e) = tuyapower.deviceInfo(PLUGID, "10.0.1.99", "0123456789abcdef", "3.3")
+    ok = (len(polls) > before) == polled and e == err
+    print("    %-44s %s" % (name, "OK" if ok else "FAILED: polled=%s err=%s" % (len(polls) > before, e)))
+    if not ok:
+        failed += 1
+
+
+tuyapower._status = status
+tuyapower.retrypolicy = tuyapower.RetryPolicy(retries=0)
+
+print("TuyaPower Circuit Breaker Test [Python %d.%d]\n" % sys.version_info[:2])
+
+# off by default - every call polls the plug however often it timed out
+for i in range(5):
+    check("default breaker poll %d" % (i + 1), True, tuyapower.Status.TIMEOUT)
+
+# opt in - the circuit opens after 2 timeouts and the plug is not polled
+tuyapower.breaker = tuyapower.CircuitBreaker(failures=2, probe=3600)
+check("breaker on, first timeout", True, tuyapower.Status.TIMEOUT)
+check("breaker on, second timeout", True, tuyapower.Status.TIMEOUT)
+check("breaker open - no poll", False, tuyapower.Status.TIMEOUT)
+
+# reset closes the circuit and deviceInfo() polls the plug again
+online[0] = True
+tuyapower.breaker.reset(PLUGID)
+check("after reset - polled again", True, tuyapower.Status.OK)
+if tuyapower.breaker.state(PLUGID) != "closed":
+    print("    %-44s FAILED: %s" % ("circuit closed", tuyapower.breaker.state(PLUGID)))
+    failed += 1
+
+if failed:
+    sys.exit("FAILED: %d breaker checks" % failed)
+print("\nOK")
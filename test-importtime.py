@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# TuyaPower (Tuya Power Stats)
+#      Import Time Test - "import tuyapower" must stay under a time budget
+#
+# Usage: python test-importtime.py [budget_ms]
+#   The budget can also be set with the IMPORTBUDGET environmental variable.
+
+from __future__ import print_function   # python 2.7 support
+import os
+import re
+import subprocess
+import sys
+
+BUDGET = 60.0   # Cumulative milliseconds allowed for "import tuyapower"
+RUNS = 5        # Best of RUNS imports is compared so a busy machine does not fail the test
+
+# Modules that must only load on first use
+LAZY = ("tinytuya", "pytuya", "Crypto", "concurrent", "requests", "orjson", "ujson", "tuyapower.backends",
+        "tuyapower.export", "tuyapower.exporter", "tuyapower.registry", "tuyapower.aio", "tuyapower.daemon")
+
+CHECK = ("import sys, tuyapower; print(' '.join(m for m in sys.modules "
+         "if m.split('.')[0] in %r or m in %r))" % (LAZY, LAZY))
+
+
+def importtime():
+    # cumulative microseconds for the tuyapower line of -X importtime
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import tuyapower"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    (out, err) = proc.communicate()
+    if proc.returncode != 0:
+        print(err.decode())
+        sys.exit("ERROR: import tuyapower failed")
+    for line in err.decode().splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| tuyapower$", line)
+        if match:
+            return int(match.group(1))
+    sys.exit("ERROR: no import time reported for tuyapower")
+
+
+if sys.version_info < (3, 7):
+    # -X importtime and lazy module attributes need python 3.7+
+    print("Import time test skipped on Python %d.%d" % sys.version_info[:2])
+    sys.exit(0)
+
+budget = float(sys.argv[1] if len(sys.argv) >= 2 else os.getenv("IMPORTBUDGET", BUDGET))
+
+ms = min(importtime() for i in range(RUNS)) / 1000.0
+print("import tuyapower: %0.1f ms (budget %0.1f ms)" % (ms, budget))
+
+loaded = subprocess.check_output([sys.executable, "-c", CHECK],
+    cwd=os.path.dirname(os.path.abspath(__file__))).decode().split()
+if loaded:
+    print("Loaded at import: %s" % ", ".join(sorted(loaded)))
+
+if ms > budget or loaded:
+    sys.exit("FAILED: import tuyapower is slower than the budget or loads modules eagerly")
+print("OK")
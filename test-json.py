@@ -4,9 +4,11 @@
 #      Power Probe - Wattage of smartplugs - JSON Output
 
 import datetime
+import json
 import os
 import sys
 import time
+from collections import OrderedDict
 from time import sleep
 
 import tuyapower
@@ -40,8 +42,4 @@ iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
 (on, w, mA, V, err) = tuyapower.deviceInfo(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
 
 # Print output json
-responsejson = (
-    '{ "datetime": "%s", "switch": "%s", "power": "%s", "current": "%s", "voltage": "%s" }'
-    % (iso_time, on, w, mA, V)
-)
-print(responsejson)
+print(json.dumps(OrderedDict([("datetime", iso_time), ("switch", on), ("power", w), ("current", mA), ("voltage", V)])))
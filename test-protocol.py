@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# TuyaPower (Tuya Power Stats)
+#      Protocol Test - decode device responses framed by FrameParser without a device
+#
+# Usage: python test-protocol.py
+
+from __future__ import print_function   # python 2.7 support
+import json
+import sys
+
+from tuyapower import protocol
+
+DEVICEID = "01234567891234567890"
+KEY = b"0123456789abcdef"
+DPS = {"devId": DEVICEID, "dps": {"1": True, "18": 123, "19": 456, "20": 1201}}
+
+failed = 0
+
+
+def check(name, result):
+    global failed
+    if result == DPS:
+        print("    %-40s OK" % name)
+    else:
+        print("    %-40s FAILED: %r" % (name, result))
+        failed += 1
+
+
+def response(vers, payload):
+    # DP_QUERY response frame as the device sends it - return code then payload
+    session = protocol.Session(DEVICEID, KEY, vers)
+    if vers != "3.1":
+        payload = session.version_header + protocol.encrypt_ecb(KEY, payload)
+    return (session, bytes(protocol.pack_message(1, protocol.DP_QUERY, b"\x00" * 4 + payload)))
+
+
+print("TuyaPower Protocol Test [Python %d.%d]\n" % sys.version_info[:2])
+body = json.dumps(DPS).encode()
+
+# FrameParser hands out memoryview payloads - decode must read the data, not its repr
+(session, frame) = response("3.1", body)
+msg = protocol.Message(1, protocol.DP_QUERY, 0, memoryview(body + b"\x00\x00"), True, protocol.PREFIX_55AA)
+check("3.1 memoryview payload", session.decode(msg))
+
+for vers in ("3.1", "3.3"):
+    (session, frame) = response(vers, body)
+    check("%s unpack" % vers, session.decode(session.unpack(frame)))
+    # split across two reads like a TCP stream
+    parser = protocol.FrameParser()
+    frames = list(parser.feed(frame[:7])) + list(parser.feed(frame[7:]))
+    for (data, header) in frames:
+        check("%s FrameParser" % vers, session.decode(session.unpack(data, header)))
+    if len(frames) != 1:
+        print("    %-40s FAILED: %d frames" % ("%s FrameParser" % vers, len(frames)))
+        failed += 1
+
+if failed:
+    sys.exit("FAILED: %d protocol checks" % failed)
+print("\nOK")
@@ -36,10 +36,10 @@ PLUGVERS = os.getenv("PLUGVERS", DEVICEVERS)
 now = datetime.datetime.utcnow()
 iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-# Poll Smart Device for Raw  Data
-(raw) = tuyapower.deviceRaw(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
-# Poll Smart Switch for Power Data
-(on, w, mA, V, err) = tuyapower.deviceInfo(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+# Poll Smart Device for Power Data and Raw Response (single request)
+status = tuyapower.deviceStatus(PLUGID, PLUGIP, PLUGKEY, PLUGVERS)
+(on, w, mA, V, err) = status[:5]
+raw = status.raw
 
 # Compute projected kWh
 day = (w / 1000.0) * 24
@@ -9,10 +9,26 @@
  Functions and Usage
    (on, w, mA, V, err) = tuyapower.deviceInfo(id, ip, key, vers)
    rawData = tuyapower.deviceRaw(id, ip, key, vers)
+   status = tuyapower.deviceStatus(id, ip, key, vers)
+   (on, w, mA, V, err, age) = tuyapower.deviceInfoCached(id, ip, key, vers, maxage)
+   buf = tuyapower.ReadingBuffer(capacity); buf.append(id, status); buf.mean(id, "w", start, end)
+   meter = tuyapower.EnergyMeter(maxgap); meter.append(id, status); wh = meter.energy(id)
+   writer = tuyapower.InfluxWriter(url); writer.write(id, status)  # also CSVWriter, PrometheusWriter
+   exporter = tuyapower.Exporter(devices, interval); exporter.start(); exporter.serve(port)
+   fleet = tuyapower.Fleet.load("devices.json"); fleet.join(devices); results = tuyapower.deviceInfoMany(fleet.targets())
+   for status in tuyapower.monitor(id, ip, key, vers, interval): ...
+   for (id, status) in tuyapower.monitorMany(devices, interval): ...
    tuyapower.devicePrint(id, ip, key, vers)
    dataJSON = tuyapower.deviceJSON(id, ip, key, vers)
-   devices = deviceScan(verbose, port)
+   for line in tuyapower.devicesJSONLines(devices, max_workers): ...
+   results = tuyapower.deviceInfoMany(devices, max_workers)
+   for (id, result) in tuyapower.deviceInfoIter(devices, max_workers): ...
+   devices = deviceScan(verbose, maxretry, idle, ports)
+   for (ip, device) in tuyapower.deviceScanIter(verbose, maxretry, idle, ports): ...
+   (ip, vers) = tuyapower.deviceLookup(id)
    scan()
+   registry = tuyapower.DeviceRegistry(); registry.start(); (ip, vers) = registry.lookup(id)
+   backend = tuyapower.useBackend(name)
 
  Parameters Sent:
    id = Device ID e.g. 01234567891234567890
@@ -20,7 +36,11 @@
    key = Device Key e.g. 0123456789abcdef
    vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
    verbose = True or False (print output)
-   port = UDP port to scan (default 6666)
+   maxretry = Scan deadline in multiples of TIMEOUT seconds (default 15)
+   idle = Seconds without a new device before a scan stops (default 8)
+   ports = UDP ports to scan (default 6666 and 6667)
+   devices = List of (id, ip, key, vers) entries to poll
+   max_workers = Maximum number of devices polled at the same time
 
  Response Data:
    on = Switch state (single) - true or false 
@@ -30,54 +50,335 @@
    V = Voltage (0 if error or not supported)
    err = Error message or OK (power data found)
    rawData = Raw response from device
+   status = PowerReading with on, w, mA, V, err, raw and timestamp from one response
+   results = Dictionary of (on, w, mA, V, err) keyed by device ID
    devices = Dictionary of all devices found with power data if available
 """
 from __future__ import print_function   # python 2.7 support
-import datetime
+import importlib
 import logging
+import os
 import sys
-from time import sleep
+import time
+import types
 import socket
 import json
-from hashlib import md5
-from Crypto.Cipher import AES
-# Attempt to load tinytuya but fall back to pytuya if not available
-try:
-    import tinytuya
-    api = "tinytuya"
-    api_ver = tinytuya.__version__
-except ImportError:
-    import pytuya
-    api = "pytuya"
-    try:
-        api_ver = pytuya.__version__
-    except:
-        api_ver = "unknown"
+import select
+from collections import OrderedDict
+from .cache import ReadingCache, ScanCache
+from .policy import CircuitBreaker, RetryPolicy
+from .pool import DevicePool
+from .reading import PowerReading, Status
 
 name = "tuyapower"
-version_tuple = (0, 2, 0)
+version_tuple = (0, 3, 0)
 version = version_string = __version__ = "%d.%d.%d" % version_tuple
 __author__ = "jasonacox"
 
 log = logging.getLogger(__name__)
 
-log.info("%s version %s", __name__, version)
-log.info("Python %s on %s", sys.version, sys.platform)
-log.info("Using %s version %r", api, api_ver)
-    
+# Lazy loading - the device backend, AES and the optional features are
+# imported on first use so "import tuyapower" stays fast for short CLI runs
+
+# Backend attributes - api and api_ver name the library in use
+def _backend(backend):
+    log.info("Using %s version %r", backend.name, backend.version)
+    return dict(backend=backend, api=backend.name, api_ver=backend.version,
+        tinytuya=getattr(backend, "module", None) if backend.name == "tinytuya" else None,
+        pytuya=getattr(backend, "module", None) if backend.name == "pytuya" else None)
+
+# Attempt to load tinytuya but fall back to pytuya or the native protocol
+def _loadapi():
+    log.info("%s version %s", __name__, version)
+    log.info("Python %s on %s", sys.version, sys.platform)
+    return _backend(importlib.import_module(".backends", __name__).load())
+
+# UDP packet payload decryption - credit to tuya-convert 
+pad = lambda s: s + (16 - len(s) % 16) * chr(16 - len(s) % 16)
+unpad = lambda s: s[:-ord(s[len(s) - 1:])]
+
+def _loadcrypto():
+    from hashlib import md5
+    from Crypto.Cipher import AES
+    udpkey = md5(b"yGAdlopoPVldABfn").digest()
+    # ECB keeps no state between blocks so one cipher for the fixed key serves every packet
+    _udpcipher = AES.new(udpkey, AES.MODE_ECB)
+    protocol = importlib.import_module(".protocol", __name__)
+    return dict(AES=AES, md5=md5, udpkey=udpkey, _udpcipher=_udpcipher,
+        _udpdecoder=protocol.BroadcastDecoder(udpkey),
+        encrypt=lambda msg, key: AES.new(key, AES.MODE_ECB).encrypt(pad(msg).encode()),
+        decrypt=lambda msg, key: unpad(AES.new(key, AES.MODE_ECB).decrypt(msg)).decode(),
+        decrypt_udp=lambda msg: unpad(_udpcipher.decrypt(msg)).decode())
+
+def _loadfutures():
+    try:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+    except ImportError:
+        # python 2.7 requires the 'futures' backport for bulk polling
+        ThreadPoolExecutor = as_completed = None
+    return dict(ThreadPoolExecutor=ThreadPoolExecutor, as_completed=as_completed)
+
+# Fastest JSON encoder available for deviceJSON() - orjson, ujson or json
+# and _loads for broadcasts - orjson parses the memoryview payload without a copy.
+# All three write compact separators and unescaped "/" so the output is the same
+# whichever one is installed
+def _loadjson():
+    try:
+        import orjson
+        return dict(_dumps=lambda obj: orjson.dumps(obj).decode(), _loads=orjson.loads)
+    except ImportError:
+        pass
+    _loads = lambda data: json.loads(bytearray(data).decode())
+    try:
+        import ujson
+        return dict(_dumps=lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False),
+            _loads=_loads)
+    except ImportError:
+        return dict(_dumps=lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")),
+            _loads=_loads)
+
+def _loadmodule(module, *names):
+    def loader():
+        module_ = importlib.import_module(module, __name__)
+        return dict((n, getattr(module_, n)) for n in names)
+    return loader
+
+# Energy integrated from the polls made by devicePrint() - used to project
+# usage from the average instead of one reading
+def _loadenergymeter():
+    return dict(energymeter=_lazy("EnergyMeter")())
+
+# attribute name -> loader returning a dictionary of attributes to set
+_LAZY = {}
+for (_loader, _names) in [
+        (_loadapi, "backend api api_ver tinytuya pytuya"),
+        (_loadmodule(".backends", "Backend", "NativeBackend", "NativeDevice"), "Backend NativeBackend NativeDevice"),
+        (_loadcrypto, "AES md5 udpkey _udpcipher _udpdecoder encrypt decrypt decrypt_udp"),
+        (_loadfutures, "ThreadPoolExecutor as_completed"),
+        (_loadjson, "_dumps _loads"),
+        (_loadenergymeter, "energymeter"),
+        (_loadmodule(".buffer", "ReadingBuffer"), "ReadingBuffer"),
+        (_loadmodule(".energy", "EnergyMeter", "integrate", "projection"), "EnergyMeter integrate projection"),
+        (_loadmodule(".export", "CSVWriter", "InfluxWriter", "PrometheusWriter"), "CSVWriter InfluxWriter PrometheusWriter"),
+        (_loadmodule(".fleet", "Fleet", "FleetDevice"), "Fleet FleetDevice"),
+        # continuous monitoring over a persistent connection
+        (_loadmodule(".stream", "monitor"), "monitor"),
+        # always-on discovery
+        (_loadmodule(".registry", "DeviceRegistry", "RegistryEntry"), "DeviceRegistry RegistryEntry"),
+        # prometheus exporter - python -m tuyapower exporter
+        (_loadmodule(".exporter", "Exporter"), "Exporter")]:
+    for _name in _names.split():
+        _LAZY[_name] = _loader
+# asyncio interface - python 3.5+
+if sys.version_info >= (3, 5):
+    for _name in ("async_deviceInfo", "async_deviceRaw", "async_deviceScan"):
+        _LAZY[_name] = _loadmodule(".aio", "async_deviceInfo", "async_deviceRaw", "async_deviceScan")
+    for _name in ("FleetMonitor", "monitorMany"):
+        _LAZY[_name] = _loadmodule(".daemon", "FleetMonitor", "monitorMany")
+
+def __getattr__(name):
+    # python 3.7+ calls this for attributes not set yet
+    loader = _LAZY.get(name)
+    if loader is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    for (key, value) in loader().items():
+        # keep anything already set, e.g. a replaced energymeter
+        globals().setdefault(key, value)
+    return globals()[name]
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+# Module attribute, loading it first if it is lazy
+def _lazy(name):
+    try:
+        return globals()[name]
+    except KeyError:
+        return __getattr__(name)
+
 # how my times to try to probe plug before giving up
 RETRY = 5
 
+# backoff, deadline and adaptive socket timeouts between tries - replace to tune
+retrypolicy = RetryPolicy()
+
+# skip plugs after repeated timeouts - off (failures=0) so every call polls the
+# plug, replace with e.g. CircuitBreaker(failures=3, probe=60) to turn it on
+breaker = CircuitBreaker(failures=0)
+
+# how many plugs to poll at the same time in deviceInfoMany()
+MAXWORKERS = 32
+
 # default polling response for error condition
 _DEFAULTS = (False, 0, 0, 0)  # w, mA, V
 
-# UDP packet payload decryption - credit to tuya-convert 
-pad = lambda s: s + (16 - len(s) % 16) * chr(16 - len(s) % 16)
-unpad = lambda s: s[:-ord(s[len(s) - 1:])]
-encrypt = lambda msg, key: AES.new(key, AES.MODE_ECB).encrypt(pad(msg).encode())
-decrypt = lambda msg, key: unpad(AES.new(key, AES.MODE_ECB).decrypt(msg)).decode()
-udpkey = md5(b"yGAdlopoPVldABfn").digest()
-decrypt_udp = lambda msg: decrypt(msg, udpkey)
+# Persistent connections - keep up to POOLSIZE devices connected, closing
+# sockets unused for POOLIDLE seconds (set POOLSIZE = 0 to disable)
+POOLSIZE = 64
+POOLIDLE = 20.0
+
+def _newDevice(deviceid, ip, key, vers):
+    return _lazy("backend").device(deviceid, ip, key, vers)
+
+devicepool = DevicePool(_newDevice, POOLSIZE, POOLIDLE)
+
+# backend = tuyapower.useBackend(name)
+def useBackend(name=None):
+    """Select the library used to talk to devices
+       backend = tuyapower.useBackend(name)
+
+    Parameters :
+        name = "tinytuya", "pytuya", "native" (built-in protocol engine),
+               a Backend instance or None for the first one installed
+
+    Response :
+        backend = Backend now in use
+    """
+    attributes = _backend(importlib.import_module(".backends", __name__).load(name))
+    globals().update(attributes)
+    # connections made with the previous library
+    devicepool.clear()
+    return attributes["backend"]
+
+# Last known value cache for deviceInfoCached() - readings younger than
+# CACHEAGE seconds are served without polling, up to CACHESIZE devices
+CACHEAGE = 5.0
+CACHESIZE = 256
+
+readingcache = ReadingCache(CACHESIZE, CACHEAGE)
+
+# Poll device for status over its pooled connection
+def _status(deviceid, ip, key, vers, timeout=None):
+    backend = _lazy("backend")
+    devicepool.maxsize = POOLSIZE
+    devicepool.idle = POOLIDLE
+    with devicepool.connection(deviceid, ip, key, vers) as d:
+        data = backend.status(d, timeout)
+    if not data or "dps" not in data:
+        # start over with a new connection on the next attempt
+        devicepool.discard(deviceid, ip, vers)
+    return data
+
+# (on, w, mA, V, err) = _parsedps(dps)
+def _parsedps(dps):
+    """Extract switch state and power data from a device DPS dictionary"""
+    sw, w, mA, V = _DEFAULTS
+    sw = dps["1"]
+    # Check to see if this is a multiswitch Tuya device
+    # assuming DP 2 (switch-2) and 10 (countdown-2) = multiswitch
+    if "10" in dps.keys() and "2" in dps.keys():
+        # return a dictionary with all switch states
+        swDict = {}
+        for e in ["1","2","3","4","5","6","7"]:
+            if e in dps.keys():
+                swDict[e] = dps[e]
+        sw = swDict
+    # Check for power data - DP 19 on some devices
+    if "19" in dps.keys():
+        w = float(dps["19"]) / 10.0
+        mA = float(dps["18"])
+        V = float(dps["20"]) / 10.0
+        err = Status.OK
+    # Check for power data - DP 5 for some 3.1 devices
+    elif "5" in dps.keys():
+        w = float(dps["5"]) / 10.0
+        mA = float(dps["4"])
+        V = float(dps["6"]) / 10.0
+        err = Status.OK
+    else:
+        err = Status.NO_POWER_DATA
+    return (sw, w, mA, V, err)
+
+# status = tuyapower.deviceStatus(id, ip, key, vers)
+def deviceStatus(deviceid, ip, key, vers):
+    """Poll Device for State and raw DPS in a single request
+       status = tuyapower.deviceStatus(id, ip, key, vers)
+
+    Retries follow tuyapower.retrypolicy (backoff, deadline and per-device
+    socket timeouts).
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+
+    Response :
+        status = PowerReading - unpacks like (on, w, mA, V, err)
+        status.on = Switch state - true or false
+        status.w = Wattage
+        status.mA = milliamps
+        status.V = Voltage
+        status.err = Status - OK (power data found) or the error
+        status.raw = Raw response from device (None if no response)
+        status.timestamp = Time of the response (seconds since epoch)
+    """
+    sw, w, mA, V = _DEFAULTS
+    iso_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    data = None
+    err = Status.TIMEOUT
+
+    if float(vers) > _lazy("backend").maxversion:
+        return PowerReading(sw, w, mA, V, Status.UNSUPPORTED, None, time.time())
+
+    if not breaker.allow(deviceid):
+        # plug keeps timing out - return the last error until the next probe
+        log.info("SKIP: Circuit open for plug %s [%s]." % (deviceid, ip))
+        return PowerReading(sw, w, mA, V, breaker.error(deviceid) or err, None, time.time())
+
+    try:
+        for timeout in retrypolicy.attempts(deviceid, RETRY):
+            start = time.time()
+            try:
+                data = _status(deviceid, ip, key, vers, timeout)
+            except KeyboardInterrupt:
+                raise
+            except:
+                err = Status.TIMEOUT
+                continue
+
+            if not data:
+                log.info("Incomplete response from plug %s [%s]." % (deviceid,ip))
+                breaker.success(deviceid)
+                return PowerReading(sw, w, mA, V, Status.INCOMPLETE, data, time.time())
+            if "Err" in data and "dps" not in data:
+                # tinytuya reports connection errors in the response
+                err = Status.TIMEOUT
+                continue
+            try:
+                (sw, w, mA, V, err) = _parsedps(data["dps"])
+            except:
+                # Unable to extract data points - try again
+                err = Status.MISSING_POWER_DATA
+                continue
+            retrypolicy.record(deviceid, time.time() - start)
+            breaker.success(deviceid)
+            info = dict(
+                datetime=iso_time, switch=sw, power=w, current=mA, voltage=V
+            )
+            log.info(str(info))
+            return PowerReading(sw, w, mA, V, err, data, time.time())
+
+    except KeyboardInterrupt:
+        log.info(
+            "CANCEL: Received interrupt from user while polling plug %s [%s]."
+            % (deviceid, ip)
+        )
+        return PowerReading(sw, w, mA, V, Status.INTERRUPTED, data, time.time())
+
+    if err == Status.MISSING_POWER_DATA:
+        log.info(
+            "NO POWER DATA: Response from plug %s [%s] missing power data."
+            % (deviceid, ip)
+        )
+        breaker.success(deviceid)
+    else:
+        log.info(
+            "TIMEOUT: No response from plug %s [%s] after %s attempts."
+            % (deviceid, ip, RETRY)
+        )
+        breaker.failure(deviceid, err)
+    return PowerReading(sw, w, mA, V, err, data, time.time())
 
 # (on, w, mA, V, err) = tuyapower.deviceInfo(id, ip, key, vers)
 def deviceInfo(deviceid, ip, key, vers):
@@ -97,102 +398,32 @@ def deviceInfo(deviceid, ip, key, vers):
         V = Voltage 
         err = Error message or OK (power data found)
     """
-    watchdog = 0
-    now = datetime.datetime.utcnow()
-    iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    while True:
-        sw, w, mA, V = _DEFAULTS
-        if(api == "tinytuya"):
-            d = tinytuya.OutletDevice(deviceid, ip, key)
-        else:
-            d = pytuya.OutletDevice(deviceid, ip, key)
-            if float(vers) > 3.3:
-                return (sw, w, mA, V, "Unsupported Version: Use tinytuya")
-        d.set_version(float(vers))
-
-        try:
-            data = d.status()
-
-        except KeyboardInterrupt:
-            log.info(
-                "CANCEL: Received interrupt from user while polling plug %s [%s]."
-                % (deviceid, ip)
-            )
-            return (sw, w, mA, V, "User Interrupt")
-
-        except:
-            watchdog += 1
-            if watchdog > RETRY:
-                log.info(
-                    "TIMEOUT: No response from plug %s [%s] after %s attempts."
-                    % (deviceid, ip, RETRY)
-                )
-                return (sw, w, mA, V, "Timeout polling device")
-            try:
-                sleep(2)
-                continue
-            except KeyboardInterrupt:
-                log.info(
-                    "CANCEL: Received interrupt from user while polling plug %s [%s]."
-                    % (deviceid, ip)
-                )
-                return (sw, w, mA, V, "User Interrupt")
-
-        try:
-            if data:
-                dps = data["dps"]
-                sw = dps["1"]
-                # Check to see if this is a multiswitch Tuya device
-                # assuming DP 2 (switch-2) and 10 (countdown-2) = multiswitch
-                if "10" in dps.keys() and "2" in dps.keys():
-                    # return a dictionary with all switch states
-                    swDict = {}
-                    for e in ["1","2","3","4","5","6","7"]:
-                        if e in dps.keys():
-                            swDict[e] = dps[e]
-                    sw = swDict
-                # Check for power data - DP 19 on some devices
-                if "19" in dps.keys():
-                    w = float(dps["19"]) / 10.0
-                    mA = float(dps["18"])
-                    V = float(dps["20"]) / 10.0
-                    key = "OK"
-                # Check for power data - DP 5 for some 3.1 devices
-                elif "5" in dps.keys():
-                    w = float(dps["5"]) / 10.0
-                    mA = float(dps["4"])
-                    V = float(dps["6"]) / 10.0
-                    key = "OK"
-                else:
-                    key = "Power data unavailable"
-                info = dict(
-                    datetime=iso_time, switch=sw, power=w, current=mA, voltage=V
-                )
-                log.info(str(info))
-            else:
-                log.info("Incomplete response from plug %s [%s]." % (deviceid,ip))
-                key = "Incomplete response"
-            return (sw, w, mA, V, key)
-
-        except:
-            # Unable to extract data points - try again
-            watchdog += 1
-            if watchdog > RETRY:
-                log.info(
-                    "NO POWER DATA: Response from plug %s [%s] missing power data."
-                    % (deviceid, ip)
-                )
-                return (sw, w, mA, V, "Missing Power Data")
-            try:
-                sleep(2)
-                continue
-            except KeyboardInterrupt:
-                log.info(
-                    "CANCEL: Received interrupt from user while polling plug %s [%s]."
-                    % (deviceid, ip)
-                )
-                return (sw, w, mA, V, "User Interrupt")
+    return tuple(deviceStatus(deviceid, ip, key, vers)[:5])
+
+# (on, w, mA, V, err, age) = tuyapower.deviceInfoCached(id, ip, key, vers)
+def deviceInfoCached(deviceid, ip, key, vers, maxage=None):
+    """Poll Device for State unless a recent reading is cached
+       (on, w, mA, V, err, age) = tuyapower.deviceInfoCached(id, ip, key, vers)
+
+    Callers asking for the same device at the same time share one poll, so
+    a plug is queried at most once per maxage seconds.
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+        maxage = Oldest reading in seconds to accept (default CACHEAGE)
+
+    Response :
+        on, w, mA, V, err = Same as deviceInfo()
+        age = Seconds since the reading was taken
+    """
+    readingcache.maxsize = CACHESIZE
+    readingcache.maxage = CACHEAGE
+    (status, age) = readingcache.get(
+        deviceid, lambda: deviceStatus(deviceid, ip, key, vers), maxage)
+    return tuple(status[:5]) + (age,)
 
 # (dps) = tuyapower.deviceInfo(id, ip, key, vers)
 def deviceRaw(deviceid, ip, key, vers):
@@ -208,46 +439,109 @@ def deviceRaw(deviceid, ip, key, vers):
     Response :
         rawData = Data response from device
     """
-    watchdog = 0
-    while True:
-        data = False
-        if(api == "tinytuya"):
-            d = tinytuya.OutletDevice(deviceid, ip, key)
-        else:
-            d = pytuya.OutletDevice(deviceid, ip, key)
-            if float(vers) > 3.3:
-                return ("ERROR: Unsupported Version: Use tinytuya")
-
-        d.set_version(float(vers))
-
-        try:
-            data = d.status()
-
-        except KeyboardInterrupt:
-            log.info(
-                "CANCEL: Received interrupt from user while polling plug %s [%s]."
-                % (deviceid, ip)
-            )
+    data = False
+    if float(vers) > _lazy("backend").maxversion:
+        return ("ERROR: Unsupported Version: Use tinytuya")
+
+    if not breaker.allow(deviceid):
+        # plug keeps timing out - return the last error until the next probe
+        log.info("SKIP: Circuit open for plug %s [%s]." % (deviceid, ip))
+        return ("ERROR: %s" % (breaker.error(deviceid) or Status.TIMEOUT))
 
-        except:
-            watchdog += 1
-            if watchdog > RETRY:
-                log.info(
-                    "TIMEOUT: No response from plug %s [%s] after %s attempts."
-                    % (deviceid, ip, RETRY)
-                )
-                return ("ERROR: Timeout polling device")
+    try:
+        for timeout in retrypolicy.attempts(deviceid, RETRY):
+            start = time.time()
             try:
-                sleep(2)
-                continue
+                data = _status(deviceid, ip, key, vers, timeout)
             except KeyboardInterrupt:
-                log.info(
-                    "CANCEL: Received interrupt from user while polling plug %s [%s]."
-                    % (deviceid, ip)
-                )
+                raise
+            except:
+                continue
+            if isinstance(data, dict) and "Err" in data and "dps" not in data:
+                # tinytuya reports connection errors in the response
+                continue
+            retrypolicy.record(deviceid, time.time() - start)
+            breaker.success(deviceid)
+            return(data)
+
+    except KeyboardInterrupt:
+        log.info(
+            "CANCEL: Received interrupt from user while polling plug %s [%s]."
+            % (deviceid, ip)
+        )
+        return(data)
 
+    log.info(
+        "TIMEOUT: No response from plug %s [%s] after %s attempts."
+        % (deviceid, ip, RETRY)
+    )
+    breaker.failure(deviceid, Status.TIMEOUT)
+    if data:
+        # last error response from tinytuya
         return(data)
+    return ("ERROR: Timeout polling device")
+
+
+# for (id, status) in _statusIter(devices) - PowerReading for each device as it responds
+def _statusIter(devices, max_workers=MAXWORKERS, caller="deviceInfoIter"):
+    (ThreadPoolExecutor, as_completed) = (_lazy("ThreadPoolExecutor"), _lazy("as_completed"))
+    if ThreadPoolExecutor is None:
+        raise ImportError("%s requires concurrent.futures (pip install futures)" % caller)
+    devices = list(devices)
+    if not devices:
+        return
+    workers = max(1, min(max_workers, len(devices)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        for (deviceid, ip, key, vers) in devices:
+            pending[pool.submit(deviceStatus, deviceid, ip, key, vers)] = (deviceid, ip)
+        for f in as_completed(pending):
+            (deviceid, ip) = pending[f]
+            try:
+                status = f.result()
+            except Exception:
+                log.info("ERROR: Unable to poll plug %s [%s]." % (deviceid, ip))
+                status = PowerReading(*_DEFAULTS + (Status.UNABLE, None, time.time()))
+            yield (deviceid, status)
+    finally:
+        # stop waiting on plugs that have not started if the caller bails out early
+        for f in pending:
+            f.cancel()
+        pool.shutdown(wait=False)
+
+# for (id, (on, w, mA, V, err)) in tuyapower.deviceInfoIter(devices)
+def deviceInfoIter(devices, max_workers=MAXWORKERS):
+    """Poll many devices concurrently and yield results as each one finishes
+       for (id, (on, w, mA, V, err)) in tuyapower.deviceInfoIter(devices):
 
+    Parameters :
+        devices = List of (id, ip, key, vers) entries
+        max_workers = Maximum number of devices polled at the same time
+
+    Response :
+        Generator of (id, (on, w, mA, V, err)) in the order devices respond
+    """
+    for (deviceid, status) in _statusIter(devices, max_workers):
+        yield (deviceid, tuple(status[:5]))
+
+# results = tuyapower.deviceInfoMany(devices)
+def deviceInfoMany(devices, max_workers=MAXWORKERS):
+    """Poll many devices concurrently using a bounded pool of workers
+       results = tuyapower.deviceInfoMany(devices, max_workers)
+
+    A sweep takes about as long as the slowest device rather than the sum
+    of all of them.
+
+    Parameters :
+        devices = List of (id, ip, key, vers) entries
+        max_workers = Maximum number of devices polled at the same time
+
+    Response :
+        results = Dictionary of (on, w, mA, V, err) keyed by device ID,
+                  in the order devices responded
+    """
+    return dict(deviceInfoIter(devices, max_workers))
 
 # Print output
 def devicePrint(deviceid, ip, key='0123456789abcdef', vers='3.1'):
@@ -262,36 +556,45 @@ def devicePrint(deviceid, ip, key='0123456789abcdef', vers='3.1'):
 
     """
     # Poll Smart Switch for Power Data
-    (on, w, mA, V, err) = deviceInfo(deviceid, ip, key, vers)
+    status = deviceStatus(deviceid, ip, key, vers)
+    (on, w, mA, V, err) = status[:5]
 
     # Check for error
-    if err != "OK":
+    if err != Status.OK:
         print(" ERROR: %s\n" % err)
 
-    # Compute projected kWh
-    day = (w / 1000.0) * 24
-    week = 7.0 * day
-    month = (week * 52.0) / 12.0
+    # Projected kWh from the average power of all devicePrint() polls so far
+    meter = _lazy("energymeter")
+    meter.append(deviceid, status)
+    projected = meter.projected(deviceid)
+    label = "average %0.1fW over %0.0fs" % (meter.average(deviceid) or 0, meter.seconds(deviceid))
+    if projected is None:
+        # single reading - assume the load stays at the current draw
+        projected = _lazy("projection")(w)
+        label = "at current draw"
+    reported = meter.device_energy(deviceid)
 
     # Print Output 
-    print("TuyaPower (Tuya Power Stats) [%s] %s [%s]"%(__version__, api, api_ver))
+    print("TuyaPower (Tuya Power Stats) [%s] %s [%s]"%(__version__, _lazy("api"), _lazy("api_ver")))
     print("\nDevice %s at %s key %s protocol %s:" % (deviceid,ip,key,vers))
     if isinstance(on,dict):
         print("    Switches (%d) On: %s" % (len(on),on)) 
     else:
         print("    Switch On: %r" % on)
-    if err == "OK":
+    if err == Status.OK:
         print("    Power (W): %f" % w)
         print("    Current (mA): %f" % mA)
         print("    Voltage (V): %f" % V)
-        print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f" % (day,week,month))
+        print("    Projected usage (kWh):  Day: %f Week: %f  Month: %f (%s)" % (projected + (label,)))
+        if reported is not None:
+            print("    Energy reported by device (Wh): %f" % reported)
     else:
         print("    NOTE: %s" % err)
 
 # JSON response
 def deviceJSON(deviceid, ip, key='0123456789abcdef', vers='3.1'):
     """Poll device on local network and return JSON formatted details
-       Response = tuyapower.devicePrint(id, ip, key, vers)
+       Response = tuyapower.deviceJSON(id, ip, key, vers)
 
     Parameters :
         id = Device ID e.g. 01234567891234567890
@@ -300,22 +603,44 @@ def deviceJSON(deviceid, ip, key='0123456789abcdef', vers='3.1'):
         vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
 
     Response:
-        JSON String
+        JSON String - numbers, switch state (true/false or an object for
+        multiswitch devices) and response message as native JSON values
+        with compact separators
 
     Note: Devices are only seen if within the same broadcast network segment
     """
-    # grab timestamp
-    now = datetime.datetime.utcnow()
-    iso_time = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return _lazy("_dumps")(_jsonRecord(deviceStatus(deviceid, ip, key, vers)))
 
-    # Poll Smart Switch for Power Data
-    (on, w, mA, V, err) = deviceInfo(deviceid, ip, key, vers)
+# NDJSON stream for a fleet
+def devicesJSONLines(devices, max_workers=MAXWORKERS):
+    """Poll many devices concurrently and yield one JSON line per device
+       for line in tuyapower.devicesJSONLines(devices): sys.stdout.write(line)
 
-    # Print JSON
-    return (
-        '{ "datetime": "%s", "switch": "%s", "power": "%s", "current": "%s", "voltage": "%s", "response": "%s" }'
-        % (iso_time, on, w, mA, V, err)
-    )
+    Parameters :
+        devices = List of (id, ip, key, vers) entries
+        max_workers = Maximum number of devices polled at the same time
+
+    Response:
+        Generator of newline terminated JSON strings (NDJSON) with the
+        deviceJSON() fields plus "id", in the order devices respond
+    """
+    dumps = _lazy("_dumps")
+    for (deviceid, status) in _statusIter(devices, max_workers, "devicesJSONLines"):
+        yield dumps(_jsonRecord(status, deviceid)) + "\n"
+
+# Dictionary of native JSON values for a PowerReading
+def _jsonRecord(status, deviceid=None):
+    record = OrderedDict()
+    if deviceid is not None:
+        record["id"] = deviceid
+    record["datetime"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(status.timestamp))
+    record["switch"] = status.on
+    record["power"] = status.w
+    record["current"] = status.mA
+    record["voltage"] = status.V
+    # plain str - Status is an Enum to the fast encoders
+    record["response"] = str(status.err)
+    return record
 
 # SCAN network for Tuya devices
 MAXCOUNT = 15       # How many tries before stopping
@@ -323,6 +648,11 @@ DEBUG = False       # Additional details beyond verbose
 UDPPORT = 6666      # Tuya 3.1 UDP Port
 UDPPORTS = 6667     # Tuya 3.3+ encrypted UDP Port
 TIMEOUT = 3.0       # Seconds to wait for a broadcast
+SCANIDLE = 8.0      # Seconds without a new device before a scan stops
+SCANWORKERS = 8     # 3.1 devices polled at the same time during a scan
+SCANCACHE = os.getenv("TUYAPOWER_SCANCACHE") # JSON file caching scan results e.g. "~/.tuyapower.json" - None to disable
+SCANTTL = 3600.0    # Seconds a cached device stays valid after it was last seen
+SCANREFRESH = 300.0 # Seconds before cached scan results are refreshed in the background
 
 # Return positive number or zero
 def floor(x):
@@ -343,19 +673,191 @@ def appenddevice(newdevice, devices):
     devices[newdevice['ip']] = newdevice
     return False
 
+# Open UDP socket listening for device broadcasts
+def _udpsocket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    # allow a DeviceRegistry and a scan to listen on the same port
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    return sock
+
+# Decode device broadcast payload - returns (result, note)
+def _decodeBroadcast(data, ip):
+    result = data
+    try:
+        # frame checked and decrypted in place - see protocol.BroadcastDecoder
+        result = _lazy("_udpdecoder").payload(data)
+        result = _lazy("_loads")(result)
+        # make sure we have the fields we need
+        (result['ip'], result['gwId'], result['productKey'], result['version'])
+        return (result, 'Valid')
+    except:
+        if(DEBUG):
+            print("*  Unexpected payload=%r\n", result)
+        return ({"ip": ip}, "Unknown")
+
 # Scan function shortcut
 def scan(maxretry = MAXCOUNT):
     """Sans your network for smart plug devices with output to stdout
     """
     d = deviceScan(True,maxretry)
 
+# Merge 3.1 poll result into device found by scan
+def _scanResult(device, poll, verbose):
+    ip = device['ip']
+    try:
+        (on, w, mA, V, err) = poll()
+        if(verbose):
+            if(err == Status.OK):
+                print("    Stats for %s: on=%s, W=%s, mA=%s, V=%s [%s]"%(ip,on,w,mA,V,err))
+            else:    
+                print("    Stats for %s: on=%s [%s]"%(ip,on,err))
+        device['on'] = on
+        device['w'] = w
+        device['mA'] = mA
+        device['V'] = V
+        device['err'] = err
+    except:
+        if(verbose):
+            print("    No Stats for %s: Unable to poll"%ip)
+        device['err'] = Status.UNABLE
+    return (ip, device)
+
+# Scan function - streaming
+def deviceScanIter(verbose = False,maxretry = MAXCOUNT,idle = SCANIDLE,ports = None,max_workers = SCANWORKERS,poll = True):
+    """Scans your network and yields each device as soon as it is ready
+        for (ip, device) in tuyapower.deviceScanIter(verbose):
+
+    The receive loop only parses broadcasts.  3.1 devices are handed to a
+    pool of max_workers threads for polling and are yielded with their
+    power data when the poll finishes; all other devices are yielded as
+    soon as they are seen.
+
+    Parameters:
+        verbose = True or False, print formatted output to stdout
+        maxretry = Scan deadline in multiples of TIMEOUT seconds
+        idle = Seconds without a new device before the scan stops
+        ports = List of UDP ports to listen on (default 6666 and 6667)
+        max_workers = Maximum number of 3.1 devices polled at the same time
+        poll = True or False, poll 3.1 devices for power data
+
+    Response:
+        Generator of (ip, device) - device is the broadcast dictionary with
+        on, w, mA, V and err added for 3.1 devices
+    """
+    if ports is None:
+        # 6666 for 3.1 devices and encrypted 6667 for 3.3+ devices
+        ports = [UDPPORT, UDPPORTS]
+    clients = []
+    for port in ports:
+        sock = _udpsocket(port)
+        sock.setblocking(False)
+        clients.append(sock)
+
+    if(verbose):
+        print("Scanning on UDP ports %s for devices (%ss idle, %ss max)...\n"
+            %(", ".join(str(p) for p in ports),idle,maxretry * TIMEOUT))
+
+    # globals
+    devices={}
+    polls = {}
+    pool = None
+    (ThreadPoolExecutor, as_completed) = (_lazy("ThreadPoolExecutor"), _lazy("as_completed"))
+    if ThreadPoolExecutor is not None:
+        pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    spinnerx = 0
+    spinner = "|/-\\|"
+    start = time.time()
+    deadline = start + maxretry * TIMEOUT
+    lastnew = start
+
+    try:
+        while True:
+            # hand back devices whose poll has finished
+            for f in [f for f in polls if f.done()]:
+                yield _scanResult(devices[polls.pop(f)], f.result, verbose)
+            wait = min(deadline, lastnew + idle) - time.time()
+            if wait <= 0:
+                break
+            if(verbose):
+                print("Scanning... %s\r"%(spinner[spinnerx]), end = '')
+                spinnerx = (spinnerx + 1) % 4
+            if(verbose or polls):
+                wait = min(wait, 0.5)
+            for client in select.select(clients, [], [], wait)[0]:
+                # drain everything queued on this port
+                while True:
+                    try:
+                        data, addr = client.recvfrom(4048)
+                    except socket.error:
+                        break
+                    if(DEBUG): 
+                        print("* Message from [%s]: %s\n"%addr,data)
+                    (result, note) = _decodeBroadcast(data, addr[0])
+                    ip = result['ip']
+                    gwId = result.get('gwId', "")
+                    productKey = result.get('productKey', "")
+                    version = result.get('version', "")
+
+                    # check to see if we have seen this device before and add to devices array
+                    if appenddevice(result, devices):
+                        continue
+                    # new device found - keep listening for idle seconds more
+                    lastnew = time.time()
+                    if(verbose):
+                        print("FOUND Device [%s payload]: %s\n    ID = %s, product = %s, Version = %s" % (note,ip,gwId,productKey,version))
+                    if(version == '3.1' and poll):
+                        # Version 3.1 - no device key requires - poll for status
+                        if pool is None:
+                            yield _scanResult(result, lambda: deviceInfo(gwId, ip, productKey, version), verbose)
+                        else:
+                            polls[pool.submit(deviceInfo, gwId, ip, productKey, version)] = ip
+                    else:
+                        # Version 3.3+ requires device key
+                        if(verbose and version != '3.1'):
+                            print("    Device Key required to poll for stats")
+                        yield (ip, result)
+        for client in clients:
+            client.close()
+        clients = []
+        # scan is over - wait for the remaining polls
+        if polls:
+            for f in as_completed(list(polls)):
+                yield _scanResult(devices[polls.pop(f)], f.result, verbose)
+    finally:
+        for client in clients:
+            client.close()
+        for f in polls:
+            f.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    if(verbose):
+        print("                    \nScan Complete!  Found %s devices in %0.1fs.\n"%(len(devices),time.time() - start))
+
 # Scan function
-def deviceScan(verbose = False,maxretry = MAXCOUNT):
+def deviceScan(verbose = False,maxretry = MAXCOUNT,idle = SCANIDLE,ports = None,max_workers = SCANWORKERS,cache = True):
     """Scans your network for smart plug devices
         devices = tuyapower.deviceScan(verbose)
 
+    All ports are watched at the same time with select() so broadcasts are
+    picked up as soon as they arrive on any of them.  The scan stops when no
+    new device has been seen for idle seconds or after maxretry * TIMEOUT
+    seconds, whichever comes first.  3.1 devices are polled for stats in the
+    background while the scan keeps listening (see deviceScanIter).
+
+    If SCANCACHE names a cache file with devices seen in the last SCANTTL
+    seconds, those are returned right away (without 3.1 power data) and the
+    cache is refreshed by a scan in the background.
+
     Parameters:
         verbose = True or False, print formatted output to stdout
+        maxretry = Scan deadline in multiples of TIMEOUT seconds
+        idle = Seconds without a new device before the scan stops
+        ports = List of UDP ports to listen on (default 6666 and 6667)
+        max_workers = Maximum number of 3.1 devices polled at the same time
+        cache = True or False, use the SCANCACHE file if set
 
     Response: 
         devices = Dictionary of all devices found with power data if available
@@ -371,111 +873,91 @@ def deviceScan(verbose = False,maxretry = MAXCOUNT):
             print("Device at %s: ID %s, state=%s, W=%s, mA=%s, V=%s [%s]"%(ip,id,on,w,mA,V,err))
 
     """
-     # Enable UDP lisenting broadcasting mode on UDP port 6666 - 3.1 Devices
-    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) 
-    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    client.bind(("", UDPPORT))
-    client.settimeout(TIMEOUT) 
-    # Enable UDP lisenting broadcasting mode on encrypted UDP port 6667 - 3.3+ Devices
-    clients = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) 
-    clients.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    clients.bind(("", UDPPORTS))
-    clients.settimeout(TIMEOUT)
-
-    if(verbose):
-        print("Scanning on UDP ports %s and %s for devices (%s retries)...\n"%(UDPPORT,UDPPORTS,maxretry))
-
-    # globals
-    devices={}
-    count = 0
-    counts = 0
-    spinnerx = 0
-    spinner = "|/-\\|"
+    scancache = _scancache() if cache else None
+    if scancache is not None:
+        devices = scancache.devices()
+        if devices:
+            if(verbose):
+                print("Using %s devices cached in %s:\n"%(len(devices),scancache.path))
+                for ip in devices:
+                    print("CACHED Device: %s\n    ID = %s, product = %s, Version = %s"
+                        %(ip,devices[ip].get('gwId', ""),devices[ip].get('productKey', ""),devices[ip].get('version', "")))
+                print("")
+            _refreshcache(scancache, maxretry, idle, ports)
+            return(devices)
+
+    devices = {}
+    for (ip, device) in deviceScanIter(verbose, maxretry, idle, ports, max_workers):
+        devices[ip] = device
+    if scancache is not None:
+        scancache.update(devices)
+    return(devices)
 
-    while (count + counts) <= maxretry:
-        note = 'invalid'
-        if(verbose):
-            print("Scanning... %s\r"%(spinner[spinnerx]), end = '')
-            spinnerx = (spinnerx + 1) % 4
+# Discovery cache shared by deviceScan and deviceLookup
+_cache = None
+def _scancache():
+    global _cache
+    if not SCANCACHE:
+        return None
+    path = os.path.expanduser(SCANCACHE)
+    if _cache is None or _cache.path != path:
+        _cache = ScanCache(path, SCANTTL)
+    _cache.ttl = SCANTTL
+    return _cache
+
+# Refresh cached scan results in the background once they are SCANREFRESH seconds old
+def _refreshcache(scancache, maxretry = MAXCOUNT, idle = SCANIDLE, ports = None):
+    if scancache.age() > SCANREFRESH:
+        scancache.refresh(lambda: dict(deviceScanIter(False, maxretry, idle, ports, poll=False)))
+
+# (ip, vers) = tuyapower.deviceLookup(id)
+def deviceLookup(deviceid, maxretry = MAXCOUNT, idle = SCANIDLE):
+    """Find the IP address and protocol version of a device
+        (ip, vers) = tuyapower.deviceLookup(id)
+
+    If SCANCACHE is set, a cached entry is returned right away and the cache
+    is refreshed in the background.  Otherwise the network is scanned until
+    the device broadcasts (and the cache updated with everything seen).
 
-        if (count <= counts):  # alternate between 6666 and 6667 ports
-            try:
-                data, addr = client.recvfrom(4048)
-            except:
-                # Timeout
-                count = count + 1
-                continue
-        else:
-            try:
-                data, addr = clients.recvfrom(4048)
-            except:
-                # Timeout
-                counts = counts + 1
-                continue
-        if(DEBUG): 
-            print("* Message from [%s]: %s\n"%addr,data)
-        ip = addr[0]
-        gwId = productKey = version = ""
-        result = data
-        try: 
-            result = data[20:-8]
-            try:
-                result = decrypt_udp(result)
-            except:
-                result = result.decode()
-
-            result = json.loads(result)
-
-            note = 'Valid'
-            ip = result['ip']
-            gwId = result['gwId']
-            productKey = result['productKey']
-            version = result['version']
-        except:
-            if(DEBUG):
-                print("*  Unexpected payload=%r\n", result)
-            result = {"ip": ip}
-            note = "Unknown"
-
-        # check to see if we have seen this device before and add to devices array
-        if appenddevice(result, devices) == False:
-            # new device found - back off count if we keep getting new devices
-            if(version=='3.1'):
-                count = floor(count - 1)
-            else:
-                counts = floor(counts - 1)
-            if(verbose):
-                print("FOUND Device [%s payload]: %s\n    ID = %s, product = %s, Version = %s" % (note,ip,gwId,productKey,version))
-            try:
-                if(version == '3.1'):
-                    # Version 3.1 - no device key requires - poll for status
-                    (on, w, mA, V, err) = deviceInfo(gwId, ip, productKey, version)
-                    if(verbose):
-                        if(err == 'OK'):
-                            print("    Stats: on=%s, W=%s, mA=%s, V=%s [%s]"%(on,w,mA,V,err))
-                        else:    
-                            print("    Stats: on=%s [%s]"%(on,err))
-                    devices[ip]['on'] = on
-                    devices[ip]['w'] = w
-                    devices[ip]['mA'] = mA
-                    devices[ip]['V'] = V
-                    devices[ip]['err'] = err
-                else:
-                    # Version 3.3+ requires device key
-                    if(verbose):
-                        print("    Device Key required to poll for stats")
-            except:
-                if(verbose):
-                    print("    No Stats for %s: Unable to poll"%ip)
-                devices[ip]['err'] = 'Unable to poll'
-        else:
-            if(version=='3.1'):
-                count = count + 1
-            else:
-                counts = counts + 1
+    Parameters:
+        id = Device ID e.g. 01234567891234567890
+        maxretry = Scan deadline in multiples of TIMEOUT seconds
+        idle = Seconds without a new device before the scan stops
 
-    if(verbose):
-        print("                    \nScan Complete!  Found %s devices.\n"%len(devices))
-        
-    return(devices)
+    Response:
+        (ip, vers) = IP address and version or (None, None) if not found
+    """
+    scancache = _scancache()
+    if scancache is not None:
+        (ip, vers) = scancache.lookup(deviceid)
+        if ip is not None:
+            _refreshcache(scancache, maxretry, idle)
+            return (ip, vers)
+
+    found = {}
+    result = (None, None)
+    for (ip, device) in deviceScanIter(False, maxretry, idle, poll=False):
+        found[ip] = device
+        if device.get('gwId') == deviceid:
+            result = (ip, device.get('version'))
+            break
+    if scancache is not None:
+        scancache.update(found)
+    return result
     
+
+# python 3.6 and older have no module __getattr__
+if sys.version_info >= (3, 5) and sys.version_info < (3, 7):
+    # python 3.5 and 3.6 - the same lazy attributes through the module class
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            return __getattr__(name)
+    sys.modules[__name__].__class__ = _LazyModule
+elif sys.version_info < (3, 5):
+    # python 2.7 - load the optional features now
+    for _name in list(_LAZY):
+        _lazy(_name)
+if sys.version_info < (3, 7):
+    # backend and AES are loaded at import as before
+    _lazy("backend")
+    _lazy("AES")
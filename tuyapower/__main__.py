@@ -8,12 +8,24 @@
 
  This will run if calling this module via command line:  
     python -m tuyapower
+    python -m tuyapower exporter --devices devices.json --port 9100
+    python -m tuyapower poll devices.json --workers 32 --format table
 """
 import tuyapower
 import sys
 
 retries = 0
 
+if len(sys.argv) > 1 and sys.argv[1] == "exporter":
+    from tuyapower.exporter import main
+    main(sys.argv[2:])
+    sys.exit(0)
+
+if len(sys.argv) > 1 and sys.argv[1] == "poll":
+    from tuyapower.sweep import main
+    main(sys.argv[2:])
+    sys.exit(0)
+
 print("TuyaPower (Tuya compatible smart plug scanner) [%s] %s [%s]\n"%(tuyapower.version,tuyapower.api,tuyapower.api_ver))
 
 try:
@@ -21,6 +33,8 @@ try:
         retries = int(sys.argv[1])
 except:
     print("Usage: python -m tuyapower <max_retry>")
+    print("       python -m tuyapower poll --help")
+    print("       python -m tuyapower exporter --help")
     sys.exit(2)
 
 if retries > 0:
@@ -0,0 +1,293 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Python asyncio interface to pull power and state data from Tuya WiFi smart devices
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ The coroutines speak the Tuya local protocol directly over asyncio streams
+ and datagram transports (see tuyapower.protocol), so one event loop can
+ keep thousands of devices in flight without a thread per device.
+
+ Functions and Usage
+   (on, w, mA, V, err) = await tuyapower.async_deviceInfo(id, ip, key, vers)
+   rawData = await tuyapower.async_deviceRaw(id, ip, key, vers)
+   devices = await tuyapower.async_deviceScan(verbose, maxretry, idle)
+
+ Parameters and response data are the same as the blocking functions.
+"""
+import asyncio
+import logging
+import time
+
+import tuyapower
+from . import protocol
+from .protocol import TCPPORT, TCPTIMEOUT
+from .reading import Status
+
+log = logging.getLogger(__name__)
+
+
+async def _readframe(reader):
+    """Read one complete frame from an asyncio StreamReader"""
+    data = await reader.readexactly(4)
+    # resync on the frame prefix if the stream is out of step
+    while data not in (protocol.PREFIX_55AA_BIN, protocol.PREFIX_6699_BIN):
+        data = data[1:] + await reader.readexactly(1)
+    if data == protocol.PREFIX_6699_BIN:
+        data += await reader.readexactly(protocol.HEADER_6699_LEN - 4)
+    else:
+        data += await reader.readexactly(protocol.HEADER_55AA_LEN - 4)
+    header = protocol.parse_header(data)
+    data += await reader.readexactly(header.total - len(data))
+    return (data, header)
+
+
+class _Connection(object):
+    """TCP connection to one device speaking the Tuya local protocol"""
+
+    def __init__(self, deviceid, ip, key, vers, timeout=TCPTIMEOUT):
+        self.ip = ip
+        self.timeout = timeout
+        self.session = protocol.Session(deviceid, key, vers)
+        self.reader = self.writer = None
+
+    async def open(self):
+        (self.reader, self.writer) = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, TCPPORT), self.timeout)
+        if not self.session.established:
+            self.writer.write(self.session.negotiate_start())
+            msg = await self.receive()
+            self.writer.write(self.session.negotiate_finish(msg))
+        return self
+
+    async def receive(self):
+        """Wait for the next frame from the device and unpack it"""
+        (data, header) = await asyncio.wait_for(_readframe(self.reader), self.timeout)
+        return self.session.unpack(data, header)
+
+    async def send(self, frame):
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def status(self):
+        """Request the device DPS and return the decoded response"""
+        await self.send(self.session.status_request())
+        device22 = self.session.device22
+        while True:
+            result = self.session.decode(await self.receive())
+            if result is not None:
+                return result
+            if self.session.device22 != device22:
+                # device asked for the device22 query - ask again
+                device22 = self.session.device22
+                await self.send(self.session.status_request())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def _status(deviceid, ip, key, vers, timeout=TCPTIMEOUT):
+    """Single attempt: connect, query status, disconnect"""
+    conn = _Connection(deviceid, ip, key, vers, timeout)
+    try:
+        await conn.open()
+        return await conn.status()
+    finally:
+        conn.close()
+
+
+# rawData = await tuyapower.async_deviceRaw(id, ip, key, vers)
+async def async_deviceRaw(deviceid, ip, key, vers):
+    """Poll Device for Status - raw DPS response (coroutine)
+       rawData = await tuyapower.async_deviceRaw(id, ip, key, vers)
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+
+    Response :
+        rawData = Data response from device
+    """
+    (policy, breaker) = (tuyapower.retrypolicy, tuyapower.breaker)
+    if not breaker.allow(deviceid):
+        return ("ERROR: %s" % (breaker.error(deviceid) or Status.TIMEOUT))
+    for (delay, timeout) in policy.schedule(deviceid, tuyapower.RETRY):
+        if delay:
+            await asyncio.sleep(delay)
+        start = time.time()
+        try:
+            data = await _status(deviceid, ip, key, vers, timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            continue
+        policy.record(deviceid, time.time() - start)
+        breaker.success(deviceid)
+        return data
+
+    log.info(
+        "TIMEOUT: No response from plug %s [%s] after %s attempts."
+        % (deviceid, ip, tuyapower.RETRY)
+    )
+    breaker.failure(deviceid, Status.TIMEOUT)
+    return ("ERROR: Timeout polling device")
+
+
+# (on, w, mA, V, err) = await tuyapower.async_deviceInfo(id, ip, key, vers)
+async def async_deviceInfo(deviceid, ip, key, vers):
+    """Poll Device for State (coroutine)
+       (on, w, mA, V, err) = await tuyapower.async_deviceInfo(id, ip, key, vers)
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+
+    Response :
+        on = Switch state - true or false
+        w = Wattage
+        mA = milliamps
+        V = Voltage
+        err = Error message or OK (power data found)
+    """
+    sw, w, mA, V = tuyapower._DEFAULTS
+    err = Status.TIMEOUT
+    (policy, breaker) = (tuyapower.retrypolicy, tuyapower.breaker)
+    if not breaker.allow(deviceid):
+        return (sw, w, mA, V, breaker.error(deviceid) or err)
+    for (delay, timeout) in policy.schedule(deviceid, tuyapower.RETRY):
+        if delay:
+            await asyncio.sleep(delay)
+        start = time.time()
+        try:
+            data = await _status(deviceid, ip, key, vers, timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            err = Status.TIMEOUT
+            continue
+        try:
+            result = tuyapower._parsedps(data["dps"])
+        except Exception:
+            # Unable to extract data points - try again
+            err = Status.MISSING_POWER_DATA
+            continue
+        policy.record(deviceid, time.time() - start)
+        breaker.success(deviceid)
+        return result
+
+    if err == Status.MISSING_POWER_DATA:
+        log.info(
+            "NO POWER DATA: Response from plug %s [%s] missing power data."
+            % (deviceid, ip)
+        )
+        breaker.success(deviceid)
+    else:
+        log.info(
+            "TIMEOUT: No response from plug %s [%s] after %s attempts."
+            % (deviceid, ip, tuyapower.RETRY)
+        )
+        breaker.failure(deviceid, err)
+    return (sw, w, mA, V, err)
+
+
+class _BroadcastProtocol(asyncio.DatagramProtocol):
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait((data, addr))
+
+
+# devices = await tuyapower.async_deviceScan(verbose, maxretry, idle)
+async def async_deviceScan(verbose=False, maxretry=tuyapower.MAXCOUNT, idle=tuyapower.SCANIDLE, ports=None):
+    """Scans your network for smart plug devices (coroutine)
+        devices = await tuyapower.async_deviceScan(verbose)
+
+    Listens on all ports at the same time and stops like deviceScan() -
+    when no new device has been seen for idle seconds or after
+    maxretry * TIMEOUT seconds, whichever comes first.  3.1 devices are
+    polled for stats concurrently while the scan keeps listening.
+
+    Parameters:
+        verbose = True or False, print formatted output to stdout
+        maxretry = Scan deadline in multiples of TIMEOUT seconds
+        idle = Seconds without a new device before the scan stops
+        ports = List of UDP ports to listen on (default 6666 and 6667)
+
+    Response:
+        devices = Dictionary of all devices found with power data if available
+    """
+    if ports is None:
+        ports = [tuyapower.UDPPORT, tuyapower.UDPPORTS]
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    transports = []
+    for port in ports:
+        sock = tuyapower._udpsocket(port)
+        sock.setblocking(False)
+        (transport, _) = await loop.create_datagram_endpoint(
+            lambda: _BroadcastProtocol(queue), sock=sock)
+        transports.append(transport)
+
+    if(verbose):
+        print("Scanning on UDP ports %s for devices (%ss idle, %ss max)...\n"
+            % (", ".join(str(p) for p in ports), idle, maxretry * tuyapower.TIMEOUT))
+
+    devices = {}
+    polls = {}
+    start = time.time()
+    deadline = start + maxretry * tuyapower.TIMEOUT
+    lastnew = start
+    try:
+        while True:
+            wait = min(deadline, lastnew + idle) - time.time()
+            if wait <= 0:
+                break
+            try:
+                (data, addr) = await asyncio.wait_for(queue.get(), wait)
+            except asyncio.TimeoutError:
+                continue
+            (result, note) = tuyapower._decodeBroadcast(data, addr[0])
+            ip = result['ip']
+            if tuyapower.appenddevice(result, devices):
+                continue
+            # new device found - keep listening for idle seconds more
+            lastnew = time.time()
+            version = result.get('version', "")
+            if(verbose):
+                print("FOUND Device [%s payload]: %s\n    ID = %s, product = %s, Version = %s"
+                    % (note, ip, result.get('gwId', ""), result.get('productKey', ""), version))
+            if(version == '3.1'):
+                # Version 3.1 - no device key requires - poll for status
+                polls[ip] = loop.create_task(async_deviceInfo(
+                    result['gwId'], ip, result['productKey'], version))
+            elif(verbose):
+                print("    Device Key required to poll for stats")
+    finally:
+        for transport in transports:
+            transport.close()
+
+    for ip in polls:
+        try:
+            (on, w, mA, V, err) = await polls[ip]
+        except Exception:
+            devices[ip]['err'] = Status.UNABLE
+            continue
+        devices[ip]['on'] = on
+        devices[ip]['w'] = w
+        devices[ip]['mA'] = mA
+        devices[ip]['V'] = V
+        devices[ip]['err'] = err
+
+    if(verbose):
+        print("\nScan Complete!  Found %s devices.\n" % len(devices))
+
+    return(devices)
@@ -0,0 +1,312 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Device library backends - tinytuya, pytuya or the built-in native protocol
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ The pollers talk to devices through one Backend chosen on first use, so
+ the hot path calls backend methods instead of checking which library is
+ installed on every poll.  NativeBackend speaks the 3.1 - 3.5 local
+ protocol itself (see tuyapower.protocol) over blocking sockets and sends
+ several frames to a device in a single write.
+
+ Functions and Usage
+   backend = load(name)               # "tinytuya", "pytuya", "native" or None
+   d = backend.device(id, ip, key, vers)
+   data = backend.status(d, timeout)
+   if backend.ready(d, timeout): data = backend.receive(d)
+   backend.refresh(d, dps)
+
+   d = NativeDevice(id, ip, key, vers, port)
+   data = d.status()
+   d.send(frame1, frame2)
+"""
+import select
+import socket
+from collections import OrderedDict, deque
+
+from . import protocol
+from .protocol import TCPPORT, TCPTIMEOUT
+
+RECVSIZE = 4096     # Bytes read from the socket at a time
+
+# tinytuya style error codes returned in {"Err": code, "Error": message}
+ERR_CONNECT = "901"
+ERR_TIMEOUT = "902"
+ERR_PAYLOAD = "904"
+
+
+def _error(code, message):
+    # error response in the tinytuya format so the pollers retry it
+    return {"Error": message, "Err": code, "Payload": None}
+
+
+def _settimeout(d, timeout):
+    # socket timeout in seconds for the next request
+    if timeout is None:
+        return
+    d.connection_timeout = timeout
+    if getattr(d, "socket", None) is not None:
+        d.socket.settimeout(timeout)
+
+
+class Backend(object):
+    """Device library used to poll devices
+
+    Subclasses create device objects and poll them.  The default methods
+    work for any device with a tinytuya style interface (socket, status(),
+    receive(), heartbeat() and updatedps()).
+    """
+    name = None
+    version = None
+    maxversion = 3.5    # newest protocol version supported
+    persistent = True   # devices keep their connection open between polls
+
+    def device(self, deviceid, ip, key, vers):
+        """New device object for one device"""
+        raise NotImplementedError
+
+    def status(self, d, timeout=None):
+        """Poll device d for its DPS over its (pooled) connection"""
+        _settimeout(d, timeout)
+        # discard updates the device pushed while the connection was idle
+        for i in range(10):
+            if d.socket is None or not select.select([d.socket], [], [], 0)[0]:
+                break
+            d.receive()
+        return d.status()
+
+    def ready(self, d, timeout):
+        """True if device d sent a response within timeout seconds"""
+        return bool(select.select([d.socket], [], [], timeout)[0])
+
+    def receive(self, d):
+        """Next response from device d - None for an acknowledgement"""
+        return d.receive()
+
+    def refresh(self, d, dps):
+        """Keep the connection to device d alive and ask it to push dps"""
+        d.heartbeat(nowait=True)
+        d.updatedps(list(dps), nowait=True)
+
+    def __repr__(self):
+        return "%s(%s %s)" % (self.__class__.__name__, self.name, self.version)
+
+
+class TinytuyaBackend(Backend):
+    """tinytuya - persistent sockets, protocol 3.1 to 3.5"""
+    name = "tinytuya"
+
+    def __init__(self):
+        import tinytuya
+        self.module = tinytuya
+        self.version = tinytuya.__version__
+
+    def device(self, deviceid, ip, key, vers):
+        d = self.module.OutletDevice(deviceid, ip, key)
+        d.set_socketPersistent(True)
+        # one connect per attempt - retrypolicy handles retries
+        d.set_socketRetryLimit(1)
+        d.set_version(float(vers))
+        return d
+
+
+class PytuyaBackend(Backend):
+    """pytuya - a new connection for every poll, protocol 3.1 to 3.3"""
+    name = "pytuya"
+    maxversion = 3.3
+    persistent = False
+
+    def __init__(self):
+        import pytuya
+        self.module = pytuya
+        self.version = getattr(pytuya, "__version__", "unknown")
+
+    def device(self, deviceid, ip, key, vers):
+        d = self.module.OutletDevice(deviceid, ip, key)
+        d.set_version(float(vers))
+        return d
+
+    def status(self, d, timeout=None):
+        _settimeout(d, timeout)
+        return d.status()
+
+
+class NativeDevice(object):
+    """Blocking connection to one device using tuyapower.protocol
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+        port = TCP port of the device (default 6668)
+
+    The connection is opened on first use and kept open.  Errors close it
+    and are returned as {"Err": code, "Error": message} like tinytuya.
+    """
+
+    def __init__(self, deviceid, ip, key, vers=3.1, port=TCPPORT, timeout=TCPTIMEOUT):
+        self.id = deviceid
+        self.address = ip
+        self.local_key = key
+        self.version = float(vers)
+        self.port = port
+        self.connection_timeout = timeout
+        self.socket = None
+        self.session = None
+        self._parser = protocol.FrameParser()
+        self._frames = deque()
+
+    def __repr__(self):
+        return "NativeDevice(%r, %r, v%s)" % (self.id, self.address, self.version)
+
+    def set_version(self, vers):
+        self.version = float(vers)
+        self.close()
+
+    def _connect(self):
+        if self.socket is not None:
+            return
+        self.session = protocol.Session(self.id, self.local_key, self.version)
+        self._reset()
+        sock = socket.create_connection((self.address, self.port), self.connection_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket = sock
+        if not self.session.established:
+            sock.sendall(self.session.negotiate_start())
+            sock.sendall(self.session.negotiate_finish(self._message()))
+
+    def _message(self):
+        # next frame from the device, reading from the socket as needed
+        while not self._frames:
+            data = self.socket.recv(RECVSIZE)
+            if not data:
+                raise socket.error("Connection closed by device")
+            self._frames.extend(self._parser.feed(data))
+        (frame, header) = self._frames.popleft()
+        return self.session.unpack(frame, header)
+
+    def _discard(self):
+        # drop updates the device pushed while the connection was idle
+        self._reset()
+        while select.select([self.socket], [], [], 0)[0]:
+            if not self.socket.recv(RECVSIZE):
+                raise socket.error("Connection closed by device")
+
+    def _failed(self, e):
+        self.close()
+        if isinstance(e, socket.timeout):
+            return _error(ERR_TIMEOUT, "Timeout waiting for device: %s" % e)
+        if isinstance(e, protocol.ProtocolError):
+            return _error(ERR_PAYLOAD, "Invalid response from device: %s" % e)
+        return _error(ERR_CONNECT, "Network error: %s" % e)
+
+    def _reset(self):
+        self._frames.clear()
+        self._parser.reset()
+
+    def pending(self):
+        """True if a complete frame is already buffered"""
+        return bool(self._frames)
+
+    def send(self, *frames):
+        """Send one or more frames to the device in a single write"""
+        self._connect()
+        self.socket.sendall(frames[0] if len(frames) == 1 else b"".join(frames))
+
+    def receive(self):
+        """Next decoded response - None for an acknowledgement"""
+        try:
+            return self.session.decode(self._message())
+        except (socket.error, protocol.ProtocolError) as e:
+            return self._failed(e)
+
+    def status(self):
+        """Request the device DPS and return the decoded response"""
+        try:
+            self._connect()
+            self._discard()
+            self.send(self.session.status_request())
+            device22 = self.session.device22
+            while True:
+                result = self.session.decode(self._message())
+                if result is not None:
+                    return result
+                if self.session.device22 != device22:
+                    # device asked for the device22 query - ask again
+                    device22 = self.session.device22
+                    self.send(self.session.status_request())
+        except (socket.error, protocol.ProtocolError) as e:
+            return self._failed(e)
+
+    def heartbeat(self, nowait=True):
+        self.send(self.session.heartbeat_request())
+        return None if nowait else self.receive()
+
+    def updatedps(self, dps=protocol.UPDATE_DPS, nowait=True):
+        self.send(self.session.updatedps_request(dps))
+        return None if nowait else self.receive()
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            finally:
+                self.socket = None
+                self._reset()
+
+
+class NativeBackend(Backend):
+    """Built-in protocol engine - persistent sockets, protocol 3.1 to 3.5"""
+    name = "native"
+
+    def __init__(self, port=TCPPORT):
+        from . import __version__
+        self.version = __version__
+        self.port = port
+
+    def device(self, deviceid, ip, key, vers):
+        return NativeDevice(deviceid, ip, key, vers, self.port)
+
+    def status(self, d, timeout=None):
+        _settimeout(d, timeout)
+        return d.status()
+
+    def ready(self, d, timeout):
+        return d.pending() or bool(select.select([d.socket], [], [], timeout)[0])
+
+    def refresh(self, d, dps):
+        # both requests go out in one write
+        d.send(d.session.heartbeat_request(), d.session.updatedps_request(dps))
+
+
+# Backends in order of preference when none is named
+BACKENDS = OrderedDict([
+    ("tinytuya", TinytuyaBackend),
+    ("pytuya", PytuyaBackend),
+    ("native", NativeBackend),
+])
+
+
+def load(name=None):
+    """Backend by name or the first one whose library is installed
+       backend = load(name)
+
+    Parameters :
+        name = "tinytuya", "pytuya", "native", a Backend instance or None
+    """
+    if isinstance(name, Backend):
+        return name
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError("Unknown backend %r - use one of %s" % (name, ", ".join(BACKENDS)))
+        return BACKENDS[name]()
+    for cls in BACKENDS.values():
+        try:
+            return cls()
+        except ImportError:
+            continue
+    raise ImportError("No backend available")
@@ -0,0 +1,264 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Columnar in-memory time series buffer for power readings
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Each device gets fixed-capacity ring buffer columns (timestamp, w, mA, V)
+ stored in contiguous array('d') blocks - 32 bytes per reading instead of
+ a Python tuple and its float objects.  When NumPy is installed, windows
+ are returned as NumPy views of the same memory and aggregates are
+ vectorized; otherwise memoryviews and plain Python loops are used.
+
+ Functions and Usage
+   buf = ReadingBuffer(capacity, typecode)
+   buf.append(id, reading)
+   buf.add(id, timestamp, w, mA, V)
+   (t, w, mA, V) = buf.window(id, start, end)
+   buf.mean(id, "w", start, end)
+   buf.percentile(id, 95, "w", start, end)
+   buf.energy(id, start, end)
+
+ Readings must be added to a device in time order.
+"""
+import threading
+from array import array
+from collections import namedtuple
+
+from .energy import integrate
+from .reading import Status
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CAPACITY = 86400    # Readings kept per device - one day at 1 Hz
+
+FIELDS = ("t", "w", "mA", "V")
+
+# columns for one time range - NumPy arrays or memoryviews sharing the buffer memory
+Window = namedtuple("Window", FIELDS)
+
+
+def _view(column, lo, hi):
+    # zero-copy slice of an array column
+    if numpy is not None:
+        return numpy.frombuffer(column, dtype=column.typecode)[lo:hi]
+    try:
+        return memoryview(column)[lo:hi]
+    except TypeError:
+        # python 2.7 arrays do not export buffers
+        return column[lo:hi]
+
+
+class _Series(object):
+    # ring buffer for one device - oldest reading at index head
+    __slots__ = ("columns", "head", "count")
+
+    def __init__(self, capacity, typecode):
+        self.columns = [array("d", [0.0]) * capacity] + [
+            array(typecode, [0.0]) * capacity for f in FIELDS[1:]]
+        self.head = 0
+        self.count = 0
+
+    def timestamp(self, i):
+        # timestamp of the i-th oldest reading
+        t = self.columns[0]
+        return t[(self.head + i) % len(t)]
+
+    def bisect(self, when):
+        # index of the first reading at or after when
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect_right(self, when):
+        # index after the last reading at or before when
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if when < self.timestamp(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def segments(self, start, end):
+        # physical (lo, hi) ranges for readings in [start, end] - two if the range wraps
+        first = 0 if start is None else self.bisect(start)
+        last = self.count if end is None else self.bisect_right(end)
+        if first >= last:
+            return []
+        size = len(self.columns[0])
+        lo = (self.head + first) % size
+        hi = lo + (last - first)
+        if hi <= size:
+            return [(lo, hi)]
+        return [(lo, size), (0, hi - size)]
+
+
+class ReadingBuffer(object):
+    """Fixed-capacity columnar ring buffer of readings per device
+
+    Parameters :
+        capacity = Readings kept per device, the oldest are overwritten
+        typecode = array type for w, mA and V - 'd' (double) or 'f' (float,
+                   half the memory).  Timestamps are always doubles.
+
+    Columns for a device are allocated when its first reading is added.
+    Windows share memory with the buffer - copy them if they must survive
+    later appends that wrap around.
+    """
+
+    def __init__(self, capacity=CAPACITY, typecode="d"):
+        self.capacity = capacity
+        self.typecode = typecode
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(s.count for s in self._series.values())
+
+    def __contains__(self, deviceid):
+        return deviceid in self._series
+
+    def devices(self):
+        """List of device IDs with readings"""
+        return list(self._series)
+
+    def count(self, deviceid):
+        """Number of readings held for a device"""
+        series = self._series.get(deviceid)
+        return 0 if series is None else series.count
+
+    def add(self, deviceid, timestamp, w, mA, V):
+        """Add one reading for a device"""
+        with self._lock:
+            series = self._series.get(deviceid)
+            if series is None:
+                series = self._series[deviceid] = _Series(self.capacity, self.typecode)
+            size = self.capacity
+            if series.count < size:
+                i = (series.head + series.count) % size
+                series.count += 1
+            else:
+                # full - overwrite the oldest reading
+                i = series.head
+                series.head = (series.head + 1) % size
+            (ct, cw, cmA, cV) = series.columns
+            ct[i] = timestamp
+            cw[i] = w
+            cmA[i] = mA
+            cV[i] = V
+
+    def append(self, deviceid, reading):
+        """Add a PowerReading - readings without power data are skipped
+
+        Response :
+            True if the reading was stored
+        """
+        if reading.err != Status.OK or reading.timestamp is None:
+            return False
+        self.add(deviceid, reading.timestamp, reading.w, reading.mA, reading.V)
+        return True
+
+    def clear(self, deviceid=None):
+        """Drop the readings for a device, or for all devices if None"""
+        with self._lock:
+            if deviceid is None:
+                self._series.clear()
+            else:
+                self._series.pop(deviceid, None)
+
+    def _parts(self, deviceid, fields, start, end):
+        # zero-copy views of each column for readings between start and end
+        series = self._series.get(deviceid)
+        if series is None:
+            return [[] for f in fields]
+        with self._lock:
+            segments = series.segments(start, end)
+            return [[_view(series.columns[FIELDS.index(f)], lo, hi) for (lo, hi) in segments]
+                    for f in fields]
+
+    def _join(self, parts, field):
+        if len(parts) == 1:
+            return parts[0]
+        if numpy is not None:
+            return numpy.concatenate(parts) if parts else numpy.empty(0)
+        joined = array(self.typecode if field != "t" else "d")
+        for part in parts:
+            joined.extend(part)
+        return joined
+
+    def _joined(self, deviceid, fields, start, end):
+        return [self._join(parts, f) for (parts, f) in
+                zip(self._parts(deviceid, fields, start, end), fields)]
+
+    def window(self, deviceid, start=None, end=None):
+        """Columns for readings between start and end (epoch seconds, inclusive)
+
+        Zero-copy unless the range wraps around the end of the ring.
+
+        Response :
+            Window(t, w, mA, V) of NumPy arrays or memoryviews
+        """
+        return Window(*self._joined(deviceid, FIELDS, start, end))
+
+    def mean(self, deviceid, field="w", start=None, end=None):
+        """Average of a field (w, mA or V) or None if there are no readings"""
+        parts = self._parts(deviceid, [field], start, end)[0]
+        n = sum(len(p) for p in parts)
+        if n == 0:
+            return None
+        if numpy is not None:
+            return float(sum(p.sum() for p in parts)) / n
+        return sum(sum(p) for p in parts) / float(n)
+
+    def min(self, deviceid, field="w", start=None, end=None):
+        """Smallest value of a field or None if there are no readings"""
+        parts = [p for p in self._parts(deviceid, [field], start, end)[0] if len(p)]
+        if not parts:
+            return None
+        if numpy is not None:
+            return float(min(p.min() for p in parts))
+        return min(min(p) for p in parts)
+
+    def max(self, deviceid, field="w", start=None, end=None):
+        """Largest value of a field or None if there are no readings"""
+        parts = [p for p in self._parts(deviceid, [field], start, end)[0] if len(p)]
+        if not parts:
+            return None
+        if numpy is not None:
+            return float(max(p.max() for p in parts))
+        return max(max(p) for p in parts)
+
+    def percentile(self, deviceid, q, field="w", start=None, end=None):
+        """q-th percentile (0-100, linear interpolation) of a field or None"""
+        values = self._joined(deviceid, [field], start, end)[0]
+        if len(values) == 0:
+            return None
+        if numpy is not None:
+            return float(numpy.percentile(values, q))
+        values = sorted(values)
+        pos = (len(values) - 1) * q / 100.0
+        lo = int(pos)
+        hi = min(lo + 1, len(values) - 1)
+        return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+    def energy(self, deviceid, start=None, end=None, maxgap=None):
+        """Energy in Wh between start and end - trapezoidal integration of w
+
+        Parameters :
+            maxgap = Skip intervals longer than this many seconds (device
+                     offline) instead of interpolating across them
+        """
+        (t, w) = self._joined(deviceid, ["t", "w"], start, end)
+        return integrate(t, w, maxgap)
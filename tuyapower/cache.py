@@ -0,0 +1,216 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Discovery cache persisted to disk and last-known-value cache for readings
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ ScanCache stores gwId -> ip, version and last_seen from scans in a JSON
+ file so a new process can look devices up with a file read instead of a
+ full scan.  Entries older than ttl seconds are ignored.
+
+ ReadingCache keeps the latest reading of each device in memory so many
+ consumers asking for the same plug share one poll per maxage seconds.
+
+ Functions and Usage
+   cache = ScanCache(path, ttl)
+   devices = cache.devices()
+   (ip, vers) = cache.lookup(id)
+   cache.update(devices)
+   cache.refresh(scan, wait)
+
+   readings = ReadingCache(maxsize, maxage)
+   (status, age) = readings.get(id, poll, maxage)
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# power data from 3.1 polls is not cached - it is stale by the next run
+_POLLED = ("on", "w", "mA", "V", "err")
+
+
+class ScanCache(object):
+    """Scan results cached in a JSON file
+
+    Parameters :
+        path = JSON file name, ~ is expanded
+        ttl = Seconds a device entry stays valid after it was last seen
+    """
+
+    def __init__(self, path, ttl=3600.0):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh = None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            return (data.get("updated", 0), data.get("devices", {}))
+        except (IOError, OSError, ValueError, AttributeError):
+            return (0, {})
+
+    def _save(self, updated, entries):
+        # write a temp file and rename so readers never see a partial file
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"updated": updated, "devices": entries}, f, indent=1, sort_keys=True)
+        try:
+            os.replace(tmp, self.path)
+        except AttributeError:
+            # python 2.7
+            os.rename(tmp, self.path)
+
+    def entries(self, now=None):
+        """Dictionary of gwId -> {ip, version, last_seen, info} not yet expired"""
+        now = now or time.time()
+        (_, entries) = self._load()
+        return dict((k, e) for (k, e) in entries.items()
+                    if now - e.get("last_seen", 0) < self.ttl)
+
+    def age(self):
+        """Seconds since the cache was last updated by a scan"""
+        return time.time() - self._load()[0]
+
+    def devices(self):
+        """Dictionary of cached broadcast data keyed by IP - same as deviceScan()"""
+        return dict((e["ip"], dict(e["info"])) for e in self.entries().values())
+
+    def lookup(self, deviceid):
+        """(ip, version) of a cached device or (None, None)"""
+        entry = self.entries().get(deviceid)
+        if entry is None:
+            return (None, None)
+        return (entry["ip"], entry["version"])
+
+    def update(self, devices):
+        """Merge deviceScan() results into the cache - devices not in this
+        scan keep their entry until it expires"""
+        now = time.time()
+        with self._lock:
+            entries = self.entries(now)
+            for info in devices.values():
+                if "gwId" not in info:
+                    continue
+                info = dict((k, v) for (k, v) in info.items() if k not in _POLLED)
+                entries[info["gwId"]] = {"ip": info["ip"], "version": info.get("version", ""),
+                                         "last_seen": now, "info": info}
+            try:
+                self._save(now, entries)
+            except (IOError, OSError) as err:
+                log.info("Unable to write scan cache %s: %s" % (self.path, err))
+
+    def refresh(self, scan, wait=False):
+        """Run scan() and merge its result - in a background thread unless
+        wait is True.  Only one refresh runs at a time."""
+        with self._lock:
+            running = self._refresh is not None and self._refresh.is_alive()
+            if not running:
+                self._refresh = threading.Thread(target=self._run, args=(scan,), name="tuyapower-cache")
+                self._refresh.daemon = True
+                self._refresh.start()
+            thread = self._refresh
+        if wait:
+            thread.join()
+
+    def _run(self, scan):
+        try:
+            self.update(scan())
+        except Exception:
+            log.exception("Background scan for %s failed" % self.path)
+
+
+class _Flight(object):
+    # a poll in progress that other callers wait on
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ReadingCache(object):
+    """Read-through LRU cache of the latest reading per device
+
+    Concurrent requests for a device that is not cached share one poll.
+
+    Parameters :
+        maxsize = Most devices kept, least recently used are dropped first
+        maxage = Seconds a reading is served before the device is polled again
+    """
+
+    def __init__(self, maxsize=256, maxage=5.0):
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self._readings = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._readings)
+
+    def get(self, deviceid, poll, maxage=None):
+        """Cached reading of a device or a fresh one from poll()
+
+        poll must return an object with a timestamp attribute (PowerReading).
+
+        Response :
+            (status, age) = reading and its age in seconds
+        """
+        if maxage is None:
+            maxage = self.maxage
+        with self._lock:
+            status = self._readings.pop(deviceid, None)
+            if status is not None:
+                # most recently used at the end
+                self._readings[deviceid] = status
+                age = time.time() - status.timestamp
+                if age <= maxage:
+                    return (status, age)
+            flight = self._flights.get(deviceid)
+            leader = flight is None
+            if leader:
+                flight = self._flights[deviceid] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return (flight.result, time.time() - flight.result.timestamp)
+        try:
+            flight.result = status = poll()
+            self.put(deviceid, status)
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[deviceid]
+            flight.done.set()
+        return (status, time.time() - status.timestamp)
+
+    def put(self, deviceid, status):
+        """Store a reading for a device"""
+        with self._lock:
+            self._readings.pop(deviceid, None)
+            self._readings[deviceid] = status
+            while len(self._readings) > max(0, self.maxsize):
+                self._readings.popitem(last=False)
+
+    def discard(self, deviceid):
+        """Forget the reading of a device"""
+        with self._lock:
+            self._readings.pop(deviceid, None)
+
+    def clear(self):
+        """Forget all readings"""
+        with self._lock:
+            self._readings.clear()
@@ -0,0 +1,180 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Monitor a fleet of Tuya WiFi smart devices from one asyncio event loop
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Each device gets a long-lived connection (see tuyapower.aio) that is kept
+ open with heartbeats.  DPS updates pushed by every device are merged into
+ one stream of (id, PowerReading) readings.  Dropped connections reconnect
+ with jittered exponential backoff per device, so one process on one core
+ can watch thousands of plugs.
+
+ Functions and Usage
+   for (id, status) in tuyapower.monitorMany(devices, interval):
+       print(id, status.w)
+
+   fleet = tuyapower.FleetMonitor(devices, interval)
+   task = loop.create_task(fleet.run())
+   (id, status) = await fleet.get()
+   fleet.stop()
+
+ Parameters:
+   devices = List of (id, ip, key, vers) entries
+   interval = Seconds between heartbeat / DPS update requests
+"""
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+
+import tuyapower
+from . import aio
+from .reading import PowerReading, Status
+from .stream import MONITORINTERVAL, RECONNECTDELAY, UPDATE_DPS, _reading
+
+log = logging.getLogger(__name__)
+
+MAXDELAY = 60.0     # Longest wait in seconds between reconnect attempts
+MAXCONNECT = 100    # Most connections (TCP connect + session key) opened at once
+
+
+class FleetMonitor(object):
+    """Long-lived connections to many devices multiplexed on one event loop
+
+    Parameters :
+        devices = List of (id, ip, key, vers) entries
+        interval = Seconds between heartbeat / DPS update requests
+        callback = Optional function(id, status) called for every reading
+                   instead of queueing it for get()
+        maxdelay = Longest reconnect backoff in seconds
+        maxconnect = Most connection handshakes in progress at once
+    """
+
+    def __init__(self, devices, interval=MONITORINTERVAL, callback=None,
+                 maxdelay=MAXDELAY, maxconnect=MAXCONNECT):
+        self.devices = list(devices)
+        self.interval = interval
+        self.callback = callback
+        self.maxdelay = maxdelay
+        self.maxconnect = maxconnect
+        self.connected = set()
+        self._queue = None
+        self._tasks = []
+        self._stop = False
+        self._stopped = None
+
+    def _emit(self, deviceid, status):
+        if self.callback is not None:
+            self.callback(deviceid, status)
+        else:
+            self._queue.put_nowait((deviceid, status))
+
+    async def get(self):
+        """Wait for the next (id, status) reading from any device"""
+        return await self._queue.get()
+
+    async def run(self):
+        """Connect to every device and stream readings until stop() is called"""
+        self._queue = asyncio.Queue()
+        self._stopped = asyncio.Event()
+        if self._stop:
+            self._stopped.set()
+        self._connecting = asyncio.Semaphore(self.maxconnect)
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._watch(*d)) for d in self.devices]
+        try:
+            await self._stopped.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self):
+        """Close all connections and end run()"""
+        self._stop = True
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _heartbeat(self, conn):
+        # keep the connection alive and ask for fresh power data
+        while True:
+            await asyncio.sleep(self.interval)
+            await conn.send(conn.session.heartbeat_request())
+            await conn.send(conn.session.updatedps_request(UPDATE_DPS))
+
+    async def _watch(self, deviceid, ip, key, vers):
+        loop = asyncio.get_event_loop()
+        # spread the initial connections over one interval
+        await asyncio.sleep(random.random() * self.interval)
+        failures = 0
+        while True:
+            # no data for three intervals means the connection is dead
+            conn = aio._Connection(deviceid, ip, key, vers, max(aio.TCPTIMEOUT, 3 * self.interval))
+            heartbeat = None
+            try:
+                async with self._connecting:
+                    await conn.open()
+                    data = await conn.status()
+                state = dict(data["dps"])
+                self.connected.add(deviceid)
+                failures = 0
+                self._emit(deviceid, _reading(state, data))
+                heartbeat = loop.create_task(self._heartbeat(conn))
+                while True:
+                    data = conn.session.decode(await conn.receive())
+                    if data and "dps" in data:
+                        state.update(data["dps"])
+                        self._emit(deviceid, _reading(state, data))
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                log.info("Connection to plug %s [%s] lost: %r" % (deviceid, ip, err))
+                if deviceid in self.connected or failures == 0:
+                    (sw, w, mA, V) = tuyapower._DEFAULTS
+                    self._emit(deviceid, PowerReading(sw, w, mA, V,
+                        Status.TIMEOUT, None, time.time()))
+                self.connected.discard(deviceid)
+            finally:
+                if heartbeat is not None:
+                    heartbeat.cancel()
+                conn.close()
+            # exponential backoff with jitter so dead plugs do not reconnect in lockstep
+            failures += 1
+            delay = min(self.maxdelay, RECONNECTDELAY * 2 ** min(failures - 1, 16))
+            await asyncio.sleep(delay * (0.5 + random.random() / 2.0))
+
+
+# for (id, status) in tuyapower.monitorMany(devices):
+def monitorMany(devices, interval=MONITORINTERVAL):
+    """Stream readings from many devices over persistent connections
+       for (id, status) in tuyapower.monitorMany(devices, interval):
+
+    All connections share one asyncio event loop running in a background
+    thread.
+
+    Parameters :
+        devices = List of (id, ip, key, vers) entries
+        interval = Seconds between heartbeat / DPS update requests
+
+    Response :
+        Generator of (id, PowerReading) in the order readings arrive
+    """
+    readings = queue.Queue()
+    fleet = FleetMonitor(devices, interval, callback=lambda i, s: readings.put((i, s)))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(fleet.run(),),
+                              name="tuyapower-monitor")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            yield readings.get()
+    finally:
+        loop.call_soon_threadsafe(fleet.stop)
+        thread.join()
+        loop.close()
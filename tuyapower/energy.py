@@ -0,0 +1,245 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Energy accumulator for power readings
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Power is integrated over the real sample timestamps with the trapezoidal
+ rule.  Intervals longer than maxgap seconds (device offline or not polled)
+ are skipped instead of assuming the load held steady across them.  Each
+ device only keeps its last sample and running totals, so memory does not
+ grow with the number of readings.
+
+ Plugs that report energy themselves (add_ele on DP 17) are tracked as a
+ second, device-side total alongside the integrated one.
+
+ Functions and Usage
+   meter = EnergyMeter(maxgap)
+   meter.append(id, reading)
+   meter.add(id, timestamp, w, counter)
+   wh = meter.energy(id)
+   wh = meter.device_energy(id)
+   (day, week, month) = meter.projected(id)
+   meter.rebuild(id, t, w)
+   wh = integrate(t, w, maxgap)
+   (day, week, month) = projection(w)
+"""
+import threading
+
+from .reading import Status
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAXGAP = 300.0      # Longest interval in seconds integrated between two samples
+ENERGYDP = "17"     # DP with energy added since the last report (add_ele)
+ENERGYSCALE = 1.0   # Wh per unit of ENERGYDP - add_ele counts 0.001 kWh
+
+
+def _integrate(t, w, maxgap=None):
+    # (Wh, seconds covered) for sample columns t and w
+    if len(t) < 2:
+        return (0.0, 0.0)
+    if numpy is not None:
+        t = numpy.asarray(t, dtype="d")
+        w = numpy.asarray(w, dtype="d")
+        dt = numpy.diff(t)
+        area = (w[1:] + w[:-1]) * dt
+        if maxgap is not None:
+            keep = dt <= maxgap
+            (area, dt) = (area[keep], dt[keep])
+        return (float(area.sum()) / 2.0 / 3600.0, float(dt.sum()))
+    (total, seconds) = (0.0, 0.0)
+    (t0, w0) = (t[0], w[0])
+    for (t1, w1) in zip(t[1:], w[1:]):
+        dt = t1 - t0
+        if maxgap is None or dt <= maxgap:
+            total += (w0 + w1) * dt
+            seconds += dt
+        (t0, w0) = (t1, w1)
+    return (total / 2.0 / 3600.0, seconds)
+
+
+def integrate(t, w, maxgap=None):
+    """Energy in Wh of power samples w (watts) taken at times t (seconds)
+
+    Trapezoidal rule, vectorized when NumPy is installed.  Intervals longer
+    than maxgap seconds are skipped.
+    """
+    return _integrate(t, w, maxgap)[0]
+
+
+def projection(w):
+    """Projected usage in kWh at a constant wattage - (day, week, month)"""
+    day = (w / 1000.0) * 24
+    week = 7.0 * day
+    month = (week * 52.0) / 12.0
+    return (day, week, month)
+
+
+def _counter(reading):
+    # device-side energy DP from the raw response or None
+    raw = reading.raw
+    if not isinstance(raw, dict) or not isinstance(raw.get("dps"), dict):
+        return None
+    value = raw["dps"].get(ENERGYDP)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Meter(object):
+    # running state for one device
+    __slots__ = ("t", "w", "wh", "seconds", "counter", "device_wh")
+
+    def __init__(self):
+        self.t = None
+        self.w = 0.0
+        self.wh = 0.0
+        self.seconds = 0.0
+        self.counter = None
+        self.device_wh = None
+
+
+class EnergyMeter(object):
+    """Running energy totals per device from streaming power samples
+
+    Parameters :
+        maxgap = Longest interval in seconds integrated between two samples,
+                 None to integrate across any gap
+    """
+
+    def __init__(self, maxgap=MAXGAP):
+        self.maxgap = maxgap
+        self._meters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._meters)
+
+    def __contains__(self, deviceid):
+        return deviceid in self._meters
+
+    def devices(self):
+        """List of device IDs with samples"""
+        return list(self._meters)
+
+    def _meter(self, deviceid):
+        meter = self._meters.get(deviceid)
+        if meter is None:
+            meter = self._meters[deviceid] = _Meter()
+        return meter
+
+    def add(self, deviceid, timestamp, w, counter=None):
+        """Add one power sample for a device
+
+        Parameters :
+            timestamp = Time of the sample (seconds since epoch)
+            w = Wattage
+            counter = Optional raw value of the device energy DP (add_ele)
+
+        Samples at or before the previous timestamp are ignored.
+
+        Response :
+            Integrated energy in Wh for the device so far
+        """
+        with self._lock:
+            meter = self._meter(deviceid)
+            if meter.t is not None:
+                if timestamp <= meter.t:
+                    return meter.wh
+                dt = timestamp - meter.t
+                if self.maxgap is None or dt <= self.maxgap:
+                    meter.wh += (meter.w + w) * dt / 2.0 / 3600.0
+                    meter.seconds += dt
+            if counter is not None:
+                if meter.counter is not None:
+                    # the device resets the DP after reporting - a drop starts over from 0
+                    added = counter - meter.counter if counter >= meter.counter else counter
+                    meter.device_wh = (meter.device_wh or 0.0) + added * ENERGYSCALE
+                elif meter.device_wh is None:
+                    # energy counted before the first sample is not ours
+                    meter.device_wh = 0.0
+                meter.counter = counter
+            meter.t = timestamp
+            meter.w = w
+            return meter.wh
+
+    def append(self, deviceid, reading):
+        """Add a PowerReading - readings without power data are skipped
+
+        Response :
+            True if the reading was used
+        """
+        if reading.err != Status.OK or reading.timestamp is None:
+            return False
+        self.add(deviceid, reading.timestamp, reading.w, _counter(reading))
+        return True
+
+    def energy(self, deviceid):
+        """Integrated energy in Wh for a device, 0 if it has no samples"""
+        meter = self._meters.get(deviceid)
+        return 0.0 if meter is None else meter.wh
+
+    def device_energy(self, deviceid):
+        """Energy in Wh reported by the device energy DP or None if the
+        device does not report energy"""
+        meter = self._meters.get(deviceid)
+        return None if meter is None else meter.device_wh
+
+    def seconds(self, deviceid):
+        """Seconds of samples integrated for a device - gaps not included"""
+        meter = self._meters.get(deviceid)
+        return 0.0 if meter is None else meter.seconds
+
+    def average(self, deviceid):
+        """Average wattage over the integrated time or None without history"""
+        meter = self._meters.get(deviceid)
+        if meter is None or meter.seconds <= 0:
+            return None
+        return meter.wh * 3600.0 / meter.seconds
+
+    def projected(self, deviceid):
+        """Projected usage in kWh from the average wattage
+
+        Response :
+            (day, week, month) or None if the device has no history
+        """
+        w = self.average(deviceid)
+        return None if w is None else projection(w)
+
+    def totals(self):
+        """Dictionary of device ID -> (Wh integrated, Wh reported by device or None)"""
+        with self._lock:
+            return dict((k, (m.wh, m.device_wh)) for (k, m) in self._meters.items())
+
+    def rebuild(self, deviceid, t, w):
+        """Replace the integrated total of a device with one computed from a
+        stored series, e.g. the columns of ReadingBuffer.window()
+
+        Later samples continue from the last one in the series.
+        """
+        (wh, seconds) = _integrate(t, w, self.maxgap)
+        with self._lock:
+            meter = self._meter(deviceid)
+            meter.wh = wh
+            meter.seconds = seconds
+            if len(t):
+                meter.t = float(t[-1])
+                meter.w = float(w[-1])
+            return wh
+
+    def reset(self, deviceid=None):
+        """Drop the totals for a device, or for all devices if None"""
+        with self._lock:
+            if deviceid is None:
+                self._meters.clear()
+            else:
+                self._meters.pop(deviceid, None)
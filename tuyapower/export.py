@@ -0,0 +1,421 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Batched writers exporting readings to time-series systems
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Readings are queued by write() and sent by a background thread in
+ batches of up to flushsize readings or every interval seconds, so one
+ HTTP request or file write covers many polls.  At most maxpending
+ readings are queued - write() then blocks (or drops the reading with
+ block=False) until the writer catches up.
+
+ Writers are callables taking (id, reading), so they can be passed as the
+ callback of a FleetMonitor or fed from deviceInfoIter() and monitorMany().
+ Numbers are written as numbers, not strings.
+
+ Functions and Usage
+   influx = InfluxWriter(url="http://influx:8086/write?db=power")
+   influx = InfluxWriter(path="readings.lp")
+   csv = CSVWriter("readings-%Y%m%d.csv")
+   csv = CSVWriter(stream=sys.stdout)
+   prom = PrometheusWriter(); prom.serve(9100)
+   writer.write(id, reading)
+   writer.extend(tuyapower.deviceInfoIter(devices))
+   fleet = tuyapower.FleetMonitor(devices, callback=writer)
+   writer.flush()
+   writer.close()
+"""
+import csv
+import json
+import logging
+import sys
+import threading
+import time
+
+from .reading import Status
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    # python 2.7
+    from urllib2 import Request, urlopen
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+log = logging.getLogger(__name__)
+
+FLUSHSIZE = 5000        # Readings sent in one batch
+FLUSHINTERVAL = 10.0    # Most seconds a reading waits before its batch is sent
+MAXPENDING = 100000     # Readings queued before write() blocks or drops
+
+CSVFIELDS = ("timestamp", "device", "on", "w", "mA", "V", "err")
+
+
+def _row(deviceid, reading):
+    # (id, timestamp, on, w, mA, V, err) for a PowerReading or (on, w, mA, V, err) tuple
+    timestamp = getattr(reading, "timestamp", None)
+    if timestamp is None:
+        timestamp = time.time()
+    (on, w, mA, V, err) = tuple(reading)[:5]
+    return (deviceid, timestamp, on, w, mA, V, err)
+
+
+class BatchWriter(object):
+    """Base class for writers - queues readings and sends them in batches
+
+    Parameters :
+        flushsize = Readings sent in one batch
+        interval = Most seconds a reading waits before it is sent
+        maxpending = Readings queued before write() blocks or drops
+        block = True to wait for room in the queue, False to drop readings
+
+    Subclasses implement send(rows) for a list of
+    (id, timestamp, on, w, mA, V, err) rows.
+    """
+
+    def __init__(self, flushsize=FLUSHSIZE, interval=FLUSHINTERVAL,
+                 maxpending=MAXPENDING, block=True):
+        self.flushsize = flushsize
+        self.interval = interval
+        self.maxpending = maxpending
+        self.block = block
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._pending = []
+        self._sending = 0
+        self._flushing = False
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="tuyapower-%s" % type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __call__(self, deviceid, reading):
+        return self.write(deviceid, reading)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, deviceid, reading):
+        """Queue one reading
+
+        Response :
+            True if queued, False if it was dropped (queue full and block is
+            False, or the writer is closed)
+        """
+        row = _row(deviceid, reading)
+        with self._changed:
+            while len(self._pending) >= self.maxpending and not self._closed:
+                if not self.block:
+                    self.dropped += 1
+                    return False
+                self._changed.wait()
+            if self._closed:
+                self.dropped += 1
+                return False
+            self._pending.append(row)
+            if len(self._pending) >= self.flushsize:
+                self._changed.notify_all()
+        return True
+
+    def extend(self, readings):
+        """Queue every (id, reading) from an iterable, e.g. deviceInfoIter()"""
+        for (deviceid, reading) in readings:
+            self.write(deviceid, reading)
+
+    def flush(self):
+        """Send everything queued so far and wait until it has been sent"""
+        with self._changed:
+            self._flushing = True
+            self._changed.notify_all()
+            while (self._pending or self._sending) and self._thread.is_alive():
+                self._changed.wait(0.1)
+
+    def close(self):
+        """Send what is queued and stop the writer thread"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join()
+
+    def send(self, rows):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            with self._changed:
+                deadline = time.time() + self.interval
+                while not (self._closed or self._flushing) and len(self._pending) < self.flushsize:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        break
+                    self._changed.wait(wait)
+                rows = self._pending[:self.flushsize]
+                del self._pending[:self.flushsize]
+                self._sending = len(rows)
+                if not self._pending:
+                    self._flushing = False
+                closed = self._closed and not self._pending
+                # room for blocked writers
+                self._changed.notify_all()
+            try:
+                if rows:
+                    self.send(rows)
+                    self.written += len(rows)
+            except Exception:
+                self.errors += 1
+                log.exception("%s dropped a batch of %d readings" % (type(self).__name__, len(rows)))
+            with self._changed:
+                self._sending = 0
+                self._changed.notify_all()
+            if closed:
+                return
+
+
+def _escape(value):
+    # influx tag keys and values escape commas, spaces and equals signs
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+def _bool(value):
+    return "true" if value else "false"
+
+
+_PRECISION = {"s": 1, "ms": 1000, "us": 1000000, "ns": 1000000000}
+
+
+class InfluxWriter(BatchWriter):
+    """Write readings in InfluxDB line protocol to an HTTP endpoint or a file
+
+    Readings without power data are skipped.
+
+    Parameters :
+        url = Write endpoint e.g. http://influx:8086/write?db=power (1.x) or
+              http://influx:8086/api/v2/write?org=home&bucket=power&precision=s
+        path = File to append lines to instead of url
+        measurement = Measurement name
+        tags = Dictionary of extra tags added to every line
+        precision = Timestamp precision - s, ms, us or ns (must match the url)
+        headers = Dictionary of extra HTTP headers e.g. Authorization
+        timeout = HTTP timeout in seconds
+        flushsize, interval, maxpending, block = See BatchWriter
+    """
+
+    def __init__(self, url=None, path=None, measurement="tuyapower", tags=None,
+                 precision="ns", headers=None, timeout=10.0, **kwargs):
+        if (url is None) == (path is None):
+            raise ValueError("InfluxWriter needs either url or path")
+        self.url = url
+        self.path = path
+        self.measurement = _escape(measurement)
+        self.tags = "".join(",%s=%s" % (_escape(k), _escape(v)) for (k, v) in sorted((tags or {}).items()))
+        self.scale = _PRECISION[precision]
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        BatchWriter.__init__(self, **kwargs)
+
+    def line(self, row):
+        """Line protocol for one row or None if it has no power data"""
+        (deviceid, timestamp, on, w, mA, V, err) = row
+        if err != Status.OK:
+            return None
+        if isinstance(on, dict):
+            switches = "".join(",on_%s=%s" % (_escape(k), _bool(v)) for (k, v) in sorted(on.items()))
+        else:
+            switches = ",on=%s" % _bool(on)
+        return "%s,device=%s%s w=%r,mA=%r,V=%r%s %d" % (
+            self.measurement, _escape(deviceid), self.tags, float(w), float(mA), float(V),
+            switches, int(timestamp * self.scale))
+
+    def send(self, rows):
+        lines = [l for l in (self.line(row) for row in rows) if l is not None]
+        if not lines:
+            return
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.path is not None:
+            with open(self.path, "ab") as f:
+                f.write(body)
+            return
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        headers.update(self.headers)
+        response = urlopen(Request(self.url, data=body, headers=headers), timeout=self.timeout)
+        try:
+            response.read()
+        finally:
+            response.close()
+
+
+class CSVWriter(BatchWriter):
+    """Append readings to rolling CSV files or an open stream
+
+    Parameters :
+        path = File name, strftime() codes are filled in from the UTC time of
+               each reading so e.g. readings-%Y%m%d.csv rolls over daily
+        stream = File object to write to instead of path e.g. sys.stdout
+        flushsize, interval, maxpending, block = See BatchWriter
+
+    Columns are timestamp, device, on, w, mA, V and err.  A header is written
+    when a file is created or the writer is opened on a stream.  Multiswitch
+    states are written as JSON.
+    """
+
+    def __init__(self, path=None, stream=None, **kwargs):
+        if (path is None) == (stream is None):
+            raise ValueError("CSVWriter needs either path or stream")
+        self.path = path
+        self.stream = stream
+        if stream is not None:
+            csv.writer(stream).writerow(CSVFIELDS)
+        BatchWriter.__init__(self, **kwargs)
+
+    def _writerows(self, f, rows):
+        csv.writer(f).writerows((timestamp, deviceid, json.dumps(on) if isinstance(on, dict) else on,
+                                 w, mA, V, err) for (deviceid, timestamp, on, w, mA, V, err) in rows)
+
+    def send(self, rows):
+        if self.stream is not None:
+            self._writerows(self.stream, rows)
+            self.stream.flush()
+            return
+        files = {}
+        for row in rows:
+            name = time.strftime(self.path, time.gmtime(row[1]))
+            files.setdefault(name, []).append(row)
+        for (name, rows) in files.items():
+            if sys.version_info[0] < 3:
+                f = open(name, "ab")
+            else:
+                f = open(name, "a", newline="")
+            with f:
+                if f.tell() == 0:
+                    csv.writer(f).writerow(CSVFIELDS)
+                self._writerows(f, rows)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PrometheusWriter(BatchWriter):
+    """Latest reading of each device in Prometheus exposition format
+
+    The exposition text is rebuilt once per batch, so a scrape returns the
+    prepared text no matter how many devices there are.
+
+    Parameters :
+        prefix = Metric name prefix
+        labels = Optional dictionary of device ID -> dictionary of extra
+                 labels for that device e.g. {"name": "Fridge"}
+        flushsize, interval, maxpending, block = See BatchWriter (interval
+            defaults to 1 second - how stale a scrape can be)
+    """
+
+    def __init__(self, prefix="tuyapower", labels=None, interval=1.0, **kwargs):
+        self.prefix = prefix
+        self.labels = dict(labels or {})
+        self.server = None
+        self._latest = {}
+        self._text = self.render()
+        BatchWriter.__init__(self, interval=interval, **kwargs)
+
+    def send(self, rows):
+        for row in rows:
+            self._latest[row[0]] = row
+        self._text = self.render()
+
+    def devicelabels(self, deviceid):
+        """Labels identifying a device - device ID plus any extra labels"""
+        labels = dict(self.labels.get(deviceid, {}))
+        labels["device"] = deviceid
+        return labels
+
+    def metrics(self):
+        """List of (name, type, help, samples) metric families - samples are
+        (labels, value) or (labels, value, suffix) e.g. suffix _sum"""
+        (up, power, current, voltage, switch, seen) = ([], [], [], [], [], [])
+        for (deviceid, timestamp, on, w, mA, V, err) in sorted(self._latest.values(), key=lambda r: r[0]):
+            device = self.devicelabels(deviceid)
+            seen.append((device, timestamp))
+            up.append((device, 1 if err == Status.OK else 0))
+            if err != Status.OK:
+                continue
+            power.append((device, w))
+            current.append((device, mA / 1000.0))
+            voltage.append((device, V))
+            states = on if isinstance(on, dict) else {"1": on}
+            for (k, v) in sorted(states.items()):
+                switch.append((dict(device, switch=k), 1 if v else 0))
+        return [
+            ("up", "gauge", "1 if the last poll returned power data", up),
+            ("power_watts", "gauge", "Power draw in watts", power),
+            ("current_amperes", "gauge", "Current in amperes", current),
+            ("voltage_volts", "gauge", "Voltage in volts", voltage),
+            ("switch_on", "gauge", "1 if the switch is on", switch),
+            ("last_reading_timestamp_seconds", "gauge", "Time of the last reading", seen),
+        ]
+
+    def render(self):
+        """Exposition text for the current metrics"""
+        out = []
+        for (name, kind, text, samples) in self.metrics():
+            name = "%s_%s" % (self.prefix, name)
+            out.append("# HELP %s %s\n# TYPE %s %s\n" % (name, text, name, kind))
+            for sample in samples:
+                (labels, value, suffix) = (sample + ("",))[:3]
+                labels = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                                  for (k, v) in sorted(labels.items()))
+                out.append("%s%s%s %r\n" % (name, suffix, "{%s}" % labels if labels else "", float(value)))
+        return "".join(out).encode("utf-8")
+
+    def text(self):
+        """Exposition text as of the last batch"""
+        return self._text
+
+    def serve(self, port=9100, addr=""):
+        """Serve /metrics over HTTP from a background thread
+
+        Response :
+            HTTP server - call shutdown() to stop it
+        """
+        writer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = writer.text()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        self.server = _Server((addr, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name="tuyapower-metrics")
+        thread.daemon = True
+        thread.start()
+        return self.server
+
+    def close(self):
+        BatchWriter.close(self)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,219 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Prometheus exporter polling a fleet of Tuya WiFi smart devices
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Devices are polled by a background thread every interval seconds, not by
+ the scrape.  Readings go to a PrometheusWriter which prepares the /metrics
+ text once per batch, so a scrape takes the same time for 5 plugs or 5000.
+ Devices listed without an IP address are found from their UDP broadcasts
+ with a DeviceRegistry and followed when their address changes.
+
+ Functions and Usage
+   python -m tuyapower exporter --devices devices.json --port 9100 --interval 30
+
+   exporter = Exporter(devices, interval, max_workers)
+   exporter.start(); exporter.serve(port)
+   exporter.stop()
+
+ Parameters:
+   devices = List of (id, ip, key, vers) entries or dictionaries with id,
+             key and optional ip, version and name (tinytuya devices.json)
+"""
+from __future__ import print_function   # python 2.7 support
+import argparse
+import logging
+import threading
+import time
+
+import tuyapower
+from .export import PrometheusWriter
+from .fleet import Fleet
+from .reading import Status
+
+log = logging.getLogger(__name__)
+
+EXPORTINTERVAL = 30.0   # Seconds between polls of the whole fleet
+EXPORTPORT = 9100       # HTTP port serving /metrics
+
+
+class _Stats(object):
+    # poll counters for one device
+    __slots__ = ("polls", "timeouts", "seconds")
+
+    def __init__(self):
+        self.polls = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+
+
+class ExporterWriter(PrometheusWriter):
+    """PrometheusWriter that adds the poll counters of an Exporter"""
+
+    def __init__(self, exporter, **kwargs):
+        self.exporter = exporter
+        PrometheusWriter.__init__(self, **kwargs)
+
+    def metrics(self):
+        families = PrometheusWriter.metrics(self)
+        exporter = self.exporter
+        (polls, timeouts, retries, duration) = ([], [], [], [])
+        for (deviceid, stats) in sorted(exporter.stats().items()):
+            device = self.devicelabels(deviceid)
+            polls.append((device, stats.polls))
+            timeouts.append((device, stats.timeouts))
+            retries.append((device, tuyapower.retrypolicy.retried(deviceid)))
+            duration.append((device, stats.seconds, "_sum"))
+            duration.append((device, stats.polls, "_count"))
+        return families + [
+            ("polls_total", "counter", "Polls made", polls),
+            ("poll_timeouts_total", "counter", "Polls without a response", timeouts),
+            ("poll_retries_total", "counter", "Retries made while polling", retries),
+            ("poll_duration_seconds", "summary", "Time spent polling", duration),
+            ("sweep_duration_seconds", "gauge", "Time the last poll of the whole fleet took",
+                [({}, exporter.sweep_seconds)]),
+            ("devices", "gauge", "Devices configured and devices with a known IP address",
+                [({"state": "configured"}, len(exporter.devices)),
+                 ({"state": "found"}, exporter.found)]),
+        ]
+
+
+class Exporter(object):
+    """Poll a fleet in the background and expose it as Prometheus metrics
+
+    Parameters :
+        devices = Fleet, list of (id, ip, key, vers) or dictionaries with
+                  id, key and optional ip, version and name
+        interval = Seconds between the start of each poll of the fleet
+        max_workers = Maximum number of devices polled at the same time
+        registry = DeviceRegistry used to find devices without an IP
+                   address (started on demand)
+    """
+
+    def __init__(self, devices, interval=EXPORTINTERVAL, max_workers=None, registry=None):
+        if not isinstance(devices, Fleet):
+            # parsed like devices.json so both accept the same entries
+            devices = Fleet(devices)
+        self.devices = list(devices)
+        self.interval = interval
+        self.max_workers = max_workers or tuyapower.MAXWORKERS
+        self.registry = registry
+        self.sweep_seconds = 0.0
+        self.found = 0
+        self._stats = dict((d.id, _Stats()) for d in self.devices)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.writer = ExporterWriter(self, labels=dict(
+            (d.id, {"name": d.name}) for d in self.devices if d.name))
+
+    def stats(self):
+        """Dictionary of device ID -> poll counters (polls, timeouts, seconds)"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _resolve(self):
+        # (id, ip, key, vers) for every device with a known address
+        devices = []
+        for (deviceid, ip, key, vers) in (d[:4] for d in self.devices):
+            if ip is None or vers is None:
+                if self.registry is None:
+                    self.registry = tuyapower.DeviceRegistry().start()
+                (found, version) = self.registry.lookup(deviceid)
+                (ip, vers) = (ip or found, vers or version)
+            if ip is not None and vers is not None:
+                devices.append((deviceid, ip, key, vers))
+        self.found = len(devices)
+        return devices
+
+    def _poll(self, device):
+        (deviceid, ip, key, vers) = device
+        start = time.time()
+        status = tuyapower.deviceStatus(deviceid, ip, key, vers)
+        seconds = time.time() - start
+        with self._lock:
+            stats = self._stats[deviceid]
+            stats.polls += 1
+            stats.seconds += seconds
+            if status.err == Status.TIMEOUT:
+                stats.timeouts += 1
+        self.writer.write(deviceid, status)
+
+    def sweep(self):
+        """Poll every device once"""
+        start = time.time()
+        devices = self._resolve()
+        if tuyapower.ThreadPoolExecutor is None:
+            for device in devices:
+                self._poll(device)
+        else:
+            pool = tuyapower.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(devices) or 1)))
+            try:
+                for f in [pool.submit(self._poll, d) for d in devices]:
+                    f.result()
+            finally:
+                pool.shutdown(wait=False)
+        self.sweep_seconds = time.time() - start
+
+    def run(self):
+        """Poll the fleet every interval seconds until stop()"""
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("Exporter sweep failed")
+            # a sweep longer than interval starts the next one right away
+            self._stop.wait(max(0, self.interval - (time.time() - start)))
+
+    def start(self):
+        """Run the poller in a background thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="tuyapower-exporter")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def serve(self, port=EXPORTPORT, addr=""):
+        """Serve /metrics over HTTP from a background thread"""
+        return self.writer.serve(port, addr)
+
+    def stop(self):
+        """Stop polling and serving"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.writer.close()
+        if self.registry is not None:
+            self.registry.stop()
+
+
+def main(argv=None):
+    """python -m tuyapower exporter - command line entry point"""
+    parser = argparse.ArgumentParser(prog="python -m tuyapower exporter",
+        description="Serve Prometheus metrics for Tuya smart plugs")
+    parser.add_argument("--devices", default="devices.json",
+        help="devices.json with id, key and optional ip, version and name (default devices.json)")
+    parser.add_argument("--port", type=int, default=EXPORTPORT, help="HTTP port for /metrics (default %d)" % EXPORTPORT)
+    parser.add_argument("--addr", default="", help="Address to listen on (default all)")
+    parser.add_argument("--interval", type=float, default=EXPORTINTERVAL,
+        help="Seconds between polls of the fleet (default %d)" % EXPORTINTERVAL)
+    parser.add_argument("--workers", type=int, default=tuyapower.MAXWORKERS,
+        help="Devices polled at the same time (default %d)" % tuyapower.MAXWORKERS)
+    args = parser.parse_args(argv)
+
+    exporter = Exporter(Fleet.load(args.devices), args.interval, args.workers)
+    exporter.serve(args.port, args.addr)
+    print("Serving metrics for %d devices on port %d every %ss - Ctrl-C to stop"
+        % (len(exporter.devices), args.port, args.interval))
+    try:
+        exporter.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.stop()
@@ -0,0 +1,181 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Fleet of Tuya WiFi smart devices loaded from a devices.json file
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Reads the devices.json written by tinytuya (python -m tinytuya wizard) or
+ pasted from the "tuya-cli wizard" output.  Files are parsed as strict
+ JSON first; only if that fails is the relaxed JavaScript object syntax
+ of tuya-cli (unquoted keys, single quotes, trailing commas) accepted.
+
+ Devices are indexed by ID, name and IP address.  join() fills in the IP
+ address and version of every device from scan results in one pass, and
+ targets() hands the devices that can be polled to the bulk pollers.
+
+ Functions and Usage
+   fleet = Fleet.load("devices.json")
+   fleet.join(tuyapower.deviceScan())
+   results = tuyapower.deviceInfoMany(fleet.targets())
+   device = fleet.get(id) or fleet.byname(name) or fleet.byip(ip)
+"""
+import json
+import re
+from collections import namedtuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# ordered like the (id, ip, key, vers) entries the pollers take
+FleetDevice = namedtuple("FleetDevice", "id ip key version name info")
+
+# strings, numbers, identifiers and everything else in tuya-cli output
+_TOKENS = re.compile(r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|[A-Za-z_$][\w$]*|\s+|.''', re.S)
+# escapes to change when a single quoted string is double quoted
+_QUOTES = re.compile(r'''\\.|"''', re.S)
+_LITERALS = ("true", "false", "null")
+
+
+def _relaxed(text):
+    # convert JavaScript object syntax to JSON
+    out = []
+    for token in _TOKENS.findall(text):
+        first = token[0]
+        if first == "'":
+            token = '"%s"' % _QUOTES.sub(lambda m: {"\\'": "'", '"': '\\"'}.get(m.group(), m.group()), token[1:-1])
+        elif (first.isalpha() or first in "_$") and token not in _LITERALS:
+            token = '"%s"' % token
+        elif first in "}]":
+            # drop a trailing comma
+            i = len(out) - 1
+            while i >= 0 and out[i].isspace():
+                i -= 1
+            if i >= 0 and out[i] == ",":
+                del out[i]
+        out.append(token)
+    return "".join(out)
+
+
+def loads(text):
+    """Parse devices.json text - strict JSON, else tuya-cli relaxed syntax"""
+    try:
+        return _loads(text)
+    except ValueError:
+        return json.loads(_relaxed(text))
+
+
+def _entry(item):
+    # FleetDevice from a devices.json dictionary or an (id, ip, key, vers[, name]) entry
+    if not isinstance(item, dict):
+        item = dict(zip(("id", "ip", "key", "version", "name"), item))
+    ip = item.get("ip") or None
+    version = item.get("version") or item.get("ver") or None
+    return FleetDevice(item.get("id") or item.get("gwId"), ip,
+                       item.get("key") or item.get("local_key") or "",
+                       None if version is None else str(version),
+                       item.get("name"), item)
+
+
+class Fleet(object):
+    """Devices with their keys, indexed by ID, name and IP address
+
+    Parameters :
+        devices = List of dictionaries with id, key and optional name, ip
+                  and version (the devices.json format) or of
+                  (id, ip, key, vers) entries
+    """
+
+    def __init__(self, devices=()):
+        self._byid = {}
+        self._byname = {}
+        self._byip = {}
+        for item in devices:
+            device = _entry(item)
+            if device.id:
+                self._add(device)
+
+    @classmethod
+    def load(cls, path):
+        """Fleet from a devices.json file"""
+        with open(path, "rb") as f:
+            return cls.parse(f.read())
+
+    @classmethod
+    def parse(cls, text):
+        """Fleet from devices.json text - a list or {"devices": [...]}"""
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        data = loads(text)
+        if isinstance(data, dict):
+            data = data.get("devices", [])
+        return cls(data)
+
+    def _add(self, device):
+        old = self._byid.get(device.id)
+        if old is not None and old.ip is not None and self._byip.get(old.ip) is old:
+            del self._byip[old.ip]
+        self._byid[device.id] = device
+        if device.name is not None:
+            # the first device keeps a name that is used twice
+            if self._byname.get(device.name, old) is old:
+                self._byname[device.name] = device
+        if device.ip is not None:
+            self._byip[device.ip] = device
+
+    def __len__(self):
+        return len(self._byid)
+
+    def __iter__(self):
+        return iter(list(self._byid.values()))
+
+    def __contains__(self, deviceid):
+        return deviceid in self._byid
+
+    def get(self, deviceid):
+        """FleetDevice for a device ID or None"""
+        return self._byid.get(deviceid)
+
+    def byname(self, name):
+        """FleetDevice with a name or None"""
+        return self._byname.get(name)
+
+    def byip(self, ip):
+        """FleetDevice at an IP address or None"""
+        return self._byip.get(ip)
+
+    def join(self, devices):
+        """Fill in IP address and version from scan results
+
+        Parameters :
+            devices = Dictionary of broadcast data keyed by IP from
+                      deviceScan(), DeviceRegistry.devices() or
+                      ScanCache.devices()
+
+        Response :
+            Number of fleet devices found in the scan results
+        """
+        found = 0
+        for (ip, info) in devices.items():
+            device = self._byid.get(info.get("gwId"))
+            if device is None:
+                continue
+            found += 1
+            version = info.get("version") or device.version
+            if device.ip != ip or device.version != version:
+                self._add(device._replace(ip=ip, version=version))
+        return found
+
+    def targets(self):
+        """List of (id, ip, key, vers) for devices with a known IP address
+        and version - ready for deviceInfoMany() or monitorMany()"""
+        return [(d.id, d.ip, d.key, d.version) for d in self._byid.values()
+                if d.ip is not None and d.version is not None]
+
+    def missing(self):
+        """List of FleetDevice without a known IP address or version"""
+        return [d for d in self._byid.values() if d.ip is None or d.version is None]
@@ -0,0 +1,238 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Retry policy for polling Tuya WiFi smart devices
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Retries back off exponentially with jitter and stop at an overall
+ deadline.  Each attempt gets a socket timeout derived from the response
+ times observed for that device, so fast plugs fail fast and slow or flaky
+ plugs get more patience.
+
+ A circuit breaker skips plugs that keep failing (e.g. unplugged) so they
+ do not use up the retry budget of every sweep.
+
+ Functions and Usage
+   policy = RetryPolicy(retries, base, factor, maxdelay, jitter, deadline, timeout)
+   for timeout in policy.attempts(id):
+       ...
+       policy.record(id, seconds)
+   for (delay, timeout) in policy.schedule(id):
+       await asyncio.sleep(delay)
+       ...
+
+   breaker = CircuitBreaker(failures, probe)
+   if breaker.allow(id): ... breaker.success(id) or breaker.failure(id, err)
+   breaker.state(id)
+   breaker.reset(id)
+"""
+import random
+import threading
+import time
+from collections import deque
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter, a deadline and adaptive timeouts
+
+    Parameters :
+        retries = Attempts after the first, None to use the caller default
+        base = Seconds to wait before the first retry
+        factor = Multiplier applied to the wait after each retry
+        maxdelay = Longest wait in seconds between attempts
+        jitter = Fraction of each wait that is randomized (0 to 1)
+        deadline = Most seconds spent on one call, None for no limit
+        timeout = Socket timeout in seconds until a device has history
+        mintimeout = Shortest adaptive socket timeout in seconds
+        maxtimeout = Longest adaptive socket timeout in seconds
+        percentile = Response time percentile used for adaptive timeouts
+        margin = Multiplier applied to that percentile
+        samples = Response times remembered per device
+    """
+
+    def __init__(self, retries=None, base=0.5, factor=2.0, maxdelay=4.0, jitter=0.5,
+                 deadline=15.0, timeout=5.0, mintimeout=1.0, maxtimeout=10.0,
+                 percentile=0.95, margin=3.0, samples=20):
+        self.retries = retries
+        self.base = base
+        self.factor = factor
+        self.maxdelay = maxdelay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.timeout = timeout
+        self.mintimeout = mintimeout
+        self.maxtimeout = maxtimeout
+        self.percentile = percentile
+        self.margin = margin
+        self.samples = samples
+        self._history = {}
+        self._retried = {}
+        self._lock = threading.Lock()
+
+    def delay(self, retry):
+        """Seconds to wait before retry number 1, 2, 3..."""
+        delay = min(self.maxdelay, self.base * self.factor ** (retry - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def record(self, deviceid, seconds):
+        """Remember how long a successful response from a device took"""
+        with self._lock:
+            history = self._history.get(deviceid)
+            if history is None:
+                history = self._history[deviceid] = deque(maxlen=self.samples)
+            history.append(seconds)
+
+    def responsetime(self, deviceid):
+        """Observed response time percentile for a device or None"""
+        with self._lock:
+            history = sorted(self._history.get(deviceid, ()))
+        # a few samples are not enough to judge a device
+        if len(history) < min(5, self.samples):
+            return None
+        return history[int(round(self.percentile * (len(history) - 1)))]
+
+    def attempt_timeout(self, deviceid):
+        """Socket timeout in seconds for the next attempt on a device"""
+        seen = self.responsetime(deviceid)
+        if seen is None:
+            return self.timeout
+        return max(self.mintimeout, min(self.maxtimeout, seen * self.margin))
+
+    def retried(self, deviceid):
+        """Total retries made for a device so far"""
+        return self._retried.get(deviceid, 0)
+
+    def schedule(self, deviceid, retries=0):
+        """Generator of (delay, timeout) per attempt - does not sleep
+
+        Wait delay seconds (0 for the first attempt) and then make the
+        attempt with a socket timeout of timeout seconds.  For callers that
+        wait on their own, e.g. with asyncio.sleep().  Stops after
+        1 + retries attempts (self.retries if set) or once the deadline has
+        passed.  Break out of the loop on success.
+        """
+        if self.retries is not None:
+            retries = self.retries
+        start = time.time()
+        (attempt, delay) = (0, 0)
+        while True:
+            timeout = self.attempt_timeout(deviceid)
+            if self.deadline is not None:
+                # never let one attempt run past the deadline
+                timeout = min(timeout, self.deadline - (time.time() - start + delay))
+                if timeout <= 0:
+                    return
+            if attempt:
+                with self._lock:
+                    self._retried[deviceid] = self._retried.get(deviceid, 0) + 1
+            yield (delay, timeout)
+            attempt += 1
+            if attempt > retries:
+                return
+            delay = self.delay(attempt)
+            if self.deadline is not None and time.time() - start + delay >= self.deadline:
+                return
+
+    def attempts(self, deviceid, retries=0):
+        """Generator of per-attempt socket timeouts - sleeps between attempts
+
+        Stops after 1 + retries attempts (self.retries if set) or once the
+        deadline has passed.  Break out of the loop on success.
+        """
+        for (delay, timeout) in self.schedule(deviceid, retries):
+            if delay:
+                time.sleep(delay)
+            yield timeout
+
+
+CLOSED = "closed"          # device is polled normally
+OPEN = "open"              # device is skipped until the probe interval passes
+HALF_OPEN = "half-open"    # one probe poll is in flight
+
+
+class _Circuit(object):
+    __slots__ = ("state", "failures", "opened", "err")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.err = None
+
+
+class CircuitBreaker(object):
+    """Per-device circuit breaker
+
+    After failures consecutive failed polls the circuit for a device opens
+    and polls return the last error right away.  Once probe seconds have
+    passed one poll is let through (half-open) - success closes the
+    circuit, failure opens it for another probe interval.
+
+    Parameters :
+        failures = Consecutive failures before a circuit opens, 0 to disable
+        probe = Seconds an open circuit waits before trying the device again
+    """
+
+    def __init__(self, failures=3, probe=60.0):
+        self.failures = failures
+        self.probe = probe
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, deviceid):
+        """True if the device should be polled now"""
+        with self._lock:
+            circuit = self._circuits.get(deviceid)
+            if circuit is None or circuit.state == CLOSED or self.failures <= 0:
+                return True
+            now = time.time()
+            if now - circuit.opened >= self.probe:
+                # let a single probe through (another one if a probe never reported back)
+                circuit.state = HALF_OPEN
+                circuit.opened = now
+                return True
+            return False
+
+    def success(self, deviceid):
+        """Record a poll that got a response - closes the circuit"""
+        with self._lock:
+            self._circuits.pop(deviceid, None)
+
+    def failure(self, deviceid, err=None):
+        """Record a poll that got no response"""
+        with self._lock:
+            circuit = self._circuits.get(deviceid)
+            if circuit is None:
+                circuit = self._circuits[deviceid] = _Circuit()
+            circuit.failures += 1
+            circuit.err = err
+            if circuit.state == HALF_OPEN or (
+                    self.failures > 0 and circuit.failures >= self.failures):
+                circuit.state = OPEN
+                circuit.opened = time.time()
+
+    def state(self, deviceid):
+        """Circuit state of a device - closed, open or half-open"""
+        circuit = self._circuits.get(deviceid)
+        return CLOSED if circuit is None else circuit.state
+
+    def error(self, deviceid):
+        """Last error recorded for a device or None"""
+        circuit = self._circuits.get(deviceid)
+        return None if circuit is None else circuit.err
+
+    def states(self):
+        """Dictionary of device ID -> (state, consecutive failures, last error)
+        for every device that has failed since its last success"""
+        with self._lock:
+            return dict((k, (c.state, c.failures, c.err)) for (k, c) in self._circuits.items())
+
+    def reset(self, deviceid=None):
+        """Close the circuit for a device, or for all devices if None"""
+        with self._lock:
+            if deviceid is None:
+                self._circuits.clear()
+            else:
+                self._circuits.pop(deviceid, None)
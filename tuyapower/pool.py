@@ -0,0 +1,171 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Persistent device connection pool
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Keeps device objects (and their open sockets and negotiated 3.4/3.5
+ session keys) alive between polls so a plug polled every few seconds does
+ not pay for a new TCP connect and handshake on every poll.
+
+ Functions and Usage
+   pool = DevicePool(factory, maxsize, idle)
+   with pool.connection(id, ip, key, vers) as d:
+       data = d.status()
+   pool.discard(id, ip, vers)
+   pool.clear()
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class _Entry(object):
+    __slots__ = ("device", "key", "lock", "last", "users")
+
+    def __init__(self, device, key):
+        self.device = device
+        self.key = key
+        self.lock = threading.Lock()
+        self.last = time.time()
+        self.users = 0
+
+
+def _close(device):
+    try:
+        device.close()
+    except Exception:
+        pass
+
+
+class DevicePool(object):
+    """Pool of persistent device connections keyed by (id, ip, vers)
+
+    Parameters :
+        factory = Function (id, ip, key, vers) returning a new device object
+                  with a close() method
+        maxsize = Maximum number of pooled devices, 0 to disable pooling
+        idle = Seconds an unused connection is kept open
+    """
+
+    def __init__(self, factory, maxsize=64, idle=20.0):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.idle = idle
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @contextmanager
+    def connection(self, deviceid, ip, key, vers):
+        """Check out the pooled device for exclusive use, creating it if needed
+
+        Any exception raised while the device is checked out drops it from
+        the pool so the next poll starts with a fresh connection.
+        """
+        if self.maxsize <= 0:
+            device = self.factory(deviceid, ip, key, vers)
+            try:
+                yield device
+            finally:
+                _close(device)
+            return
+        entry = self._checkout(deviceid, ip, key, vers)
+        try:
+            with entry.lock:
+                yield entry.device
+        except BaseException:
+            self.discard(deviceid, ip, vers)
+            raise
+        finally:
+            with self._lock:
+                entry.users -= 1
+                entry.last = time.time()
+
+    def _checkout(self, deviceid, ip, key, vers):
+        k = (deviceid, ip, str(vers))
+        stale = []
+        new = None
+        while True:
+            with self._lock:
+                entry = self._entries.pop(k, None)
+                if entry is not None and entry.key != key and entry.users == 0:
+                    # device was re-paired with a new local key
+                    stale.append(entry.device)
+                    entry = None
+                if entry is None and new is not None:
+                    entry = new
+                elif new is not None:
+                    # another thread created the same device first
+                    stale.append(new.device)
+                if entry is not None:
+                    # most recently used at the end
+                    self._entries[k] = entry
+                    entry.users += 1
+                    stale.extend(self._evict())
+                    self._startReaper()
+                    break
+            # create outside the lock - some devices talk to the network on setup
+            new = _Entry(self.factory(deviceid, ip, key, vers), key)
+        for device in stale:
+            _close(device)
+        return entry
+
+    def _evict(self, now=None):
+        # remove idle and excess entries that are not checked out (caller holds _lock)
+        now = now or time.time()
+        evicted = []
+        for k in list(self._entries):
+            entry = self._entries[k]
+            over = len(self._entries) > self.maxsize
+            if not over and now - entry.last < self.idle:
+                continue
+            if entry.users == 0:
+                del self._entries[k]
+                evicted.append(entry.device)
+        return evicted
+
+    def _startReaper(self):
+        # background thread closes idle sockets so plugs are not held open (caller holds _lock)
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap, name="tuyapower-pool")
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle / 2.0, 0.5))
+            with self._lock:
+                evicted = self._evict()
+                empty = not self._entries
+                if empty:
+                    self._reaper = None
+            for device in evicted:
+                log.debug("Closing idle pooled connection %r" % device)
+                _close(device)
+            if empty:
+                return
+
+    def discard(self, deviceid, ip, vers):
+        """Close and forget the pooled connection for a device"""
+        with self._lock:
+            entry = self._entries.pop((deviceid, ip, str(vers)), None)
+        if entry is not None:
+            _close(entry.device)
+
+    def clear(self):
+        """Close all pooled connections"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            _close(entry.device)
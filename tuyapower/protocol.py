@@ -0,0 +1,531 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Tuya local protocol (3.1 - 3.5) message framing and encryption
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ This module does no network I/O.  A Session builds the request frames for
+ one device and decodes the frames the device sends back, so the same code
+ can be driven by blocking sockets, selectors or asyncio transports.
+
+ Functions and Usage
+   session = Session(id, key, vers)
+   frame = session.negotiate_start()        # 3.4 and 3.5 only
+   frame = session.negotiate_finish(msg)    # 3.4 and 3.5 only
+   frame = session.status_request()
+   header = parse_header(data)
+   msg = session.unpack(data)
+   result = session.decode(msg)
+   for (frame, header) in FrameParser().feed(data): ...
+   payload = BroadcastDecoder().payload(datagram)
+
+ Frame Layout:
+   3.1 - 3.4  55AA prefix, seqno, cmd, length, [retcode], payload, CRC32 or HMAC, suffix
+   3.5        6699 prefix, 0, seqno, cmd, length, IV, payload, GCM tag, suffix
+"""
+import base64
+import binascii
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from hashlib import md5, sha256
+
+from Crypto.Cipher import AES
+
+# Tuya command types
+SESS_KEY_NEG_START = 3
+SESS_KEY_NEG_RESP = 4
+SESS_KEY_NEG_FINISH = 5
+CONTROL = 7
+STATUS = 8
+HEART_BEAT = 9
+DP_QUERY = 10
+CONTROL_NEW = 13
+DP_QUERY_NEW = 16
+UPDATEDPS = 18
+
+# Commands sent without the 3.x version header
+NO_PROTOCOL_HEADER_CMDS = (DP_QUERY, DP_QUERY_NEW, UPDATEDPS, HEART_BEAT,
+    SESS_KEY_NEG_START, SESS_KEY_NEG_RESP, SESS_KEY_NEG_FINISH)
+
+PREFIX_55AA = 0x000055AA
+SUFFIX_55AA = 0x0000AA55
+PREFIX_6699 = 0x00006699
+SUFFIX_6699 = 0x00009966
+PREFIX_55AA_BIN = b"\x00\x00\x55\xaa"
+PREFIX_6699_BIN = b"\x00\x00\x66\x99"
+HEADER_55AA_LEN = 16    # prefix, seqno, cmd, length
+HEADER_6699_LEN = 18    # prefix, unknown, seqno, cmd, length
+PROTOCOL_3x_HEADER = 12 * b"\x00"
+UDPKEY = md5(b"yGAdlopoPVldABfn").digest()  # key of the discovery broadcasts
+MAX_PAYLOAD = 8192      # anything larger is a corrupt or out of sync stream
+TCPPORT = 6668          # Tuya TCP Local Port
+TCPTIMEOUT = 5.0        # Seconds to wait for connect or response
+
+# DPS requested from 22 character ID (device22) and 3.2 devices - switches and power
+DEVICE22_DPS = ("1", "2", "3", "4", "5", "6", "7", "17", "18", "19", "20")
+# DPS the device is asked to refresh - current, power and voltage
+UPDATE_DPS = (4, 5, 6, 18, 19, 20)
+
+# Precompiled packers - frames are packed into one preallocated buffer
+_HEADER_55AA = struct.Struct(">4I")
+_HEADER_6699 = struct.Struct(">IHIII")
+_UINT32 = struct.Struct(">I")
+
+Header = namedtuple("Header", "prefix seqno cmd length total")
+Message = namedtuple("Message", "seqno cmd retcode payload crc_good prefix")
+
+
+class ProtocolError(Exception):
+    """Frame or payload could not be decoded"""
+
+
+# AES helpers - ECB for 3.1 to 3.4 payloads, GCM for 3.5 frames
+def _pad(s):
+    n = 16 - len(s) % 16
+    return s + bytes(bytearray([n] * n))
+
+def _unpad(s):
+    n = bytearray(s[-1:])[0] if s else 0
+    if n < 1 or n > 16:
+        raise ProtocolError("Invalid padding")
+    return s[:-n]
+
+def encrypt_ecb(key, raw, pad=True):
+    return AES.new(key, AES.MODE_ECB).encrypt(_pad(raw) if pad else raw)
+
+def decrypt_ecb(key, enc):
+    if len(enc) % 16:
+        raise ProtocolError("Invalid length %d for AES payload" % len(enc))
+    return _unpad(AES.new(key, AES.MODE_ECB).decrypt(enc))
+
+def encrypt_gcm(key, raw, iv, aad=None):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+    if aad:
+        cipher.update(aad)
+    (enc, tag) = cipher.encrypt_and_digest(raw)
+    return (enc, tag)
+
+def decrypt_gcm(key, enc, iv, tag, aad=None):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+    if aad:
+        cipher.update(aad)
+    try:
+        return cipher.decrypt_and_verify(enc, tag)
+    except ValueError:
+        raise ProtocolError("GCM authentication failed")
+
+
+def parse_header(data, offset=0):
+    """Parse the fixed size header of the frame at data[offset:]
+       header = parse_header(data, offset)
+
+    Response :
+        header = Header(prefix, seqno, cmd, length, total) where total is
+                 the size in bytes of the complete frame
+    """
+    available = len(data) - offset
+    if available >= HEADER_55AA_LEN:
+        (prefix, seqno, cmd, length) = _HEADER_55AA.unpack_from(data, offset)
+    elif available >= 4:
+        prefix = _UINT32.unpack_from(data, offset)[0]
+    else:
+        raise ProtocolError("Not enough data to unpack header")
+    if prefix == PREFIX_55AA:
+        if available < HEADER_55AA_LEN:
+            raise ProtocolError("Not enough data to unpack header")
+        total = HEADER_55AA_LEN + length
+    elif prefix == PREFIX_6699:
+        if available < HEADER_6699_LEN:
+            raise ProtocolError("Not enough data to unpack header")
+        (prefix, _, seqno, cmd, length) = _HEADER_6699.unpack_from(data, offset)
+        total = HEADER_6699_LEN + length + 4
+    else:
+        raise ProtocolError("Unknown frame prefix %08x" % prefix)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError("Frame length %d is too large" % length)
+    return Header(prefix, seqno, cmd, length, total)
+
+
+def pack_message(seqno, cmd, payload, key=None, prefix=PREFIX_55AA, iv=None):
+    """Build a frame from an (already encrypted for 55AA) payload
+       frame = pack_message(seqno, cmd, payload, key, prefix)
+
+    The frame is packed into a single preallocated bytearray.
+
+    Parameters :
+        key = HMAC key for 3.4 55AA frames or GCM key for 6699 frames,
+              None to use a CRC32 checksum (3.1 - 3.3)
+    """
+    if prefix == PREFIX_6699:
+        iv = iv or os.urandom(12)
+        length = 12 + len(payload) + 16
+        frame = bytearray(HEADER_6699_LEN + length + 4)
+        _HEADER_6699.pack_into(frame, 0, PREFIX_6699, 0, seqno, cmd, length)
+        (enc, tag) = encrypt_gcm(key, payload, iv, bytes(frame[4:HEADER_6699_LEN]))
+        end = HEADER_6699_LEN + 12 + len(enc)
+        frame[HEADER_6699_LEN:end] = iv + enc
+        frame[end:end + 16] = tag
+        _UINT32.pack_into(frame, end + 16, SUFFIX_6699)
+        return frame
+    length = len(payload) + (32 if key else 4) + 4
+    frame = bytearray(HEADER_55AA_LEN + length)
+    _HEADER_55AA.pack_into(frame, 0, PREFIX_55AA, seqno, cmd, length)
+    end = HEADER_55AA_LEN + len(payload)
+    frame[HEADER_55AA_LEN:end] = payload
+    if key:
+        frame[end:end + 32] = hmac.new(key, bytes(frame[:end]), sha256).digest()
+        end += 32
+    else:
+        _UINT32.pack_into(frame, end, binascii.crc32(bytes(frame[:end])) & 0xFFFFFFFF)
+        end += 4
+    _UINT32.pack_into(frame, end, SUFFIX_55AA)
+    return frame
+
+
+def unpack_message(data, key=None, header=None, retcode=True):
+    """Split a received frame into a Message, checking the CRC/HMAC/GCM tag
+       msg = unpack_message(data, key)
+
+    The frame is read through a memoryview - the payload of a 55AA frame
+    is a memoryview slice of data, not a copy.
+
+    Parameters :
+        key = HMAC key for 3.4 55AA frames or GCM key for 6699 frames
+        retcode = True if the frame carries a return code (device responses)
+
+    Response :
+        msg = Message(seqno, cmd, retcode, payload, crc_good, prefix)
+    """
+    if header is None:
+        header = parse_header(data)
+    if len(data) < header.total:
+        raise ProtocolError("Not enough data to unpack payload")
+    view = data if type(data) is memoryview else memoryview(data)
+    total = header.total
+    rc = 0
+    if header.prefix == PREFIX_6699:
+        if not key:
+            raise ProtocolError("Key required to unpack 6699 frame")
+        payload = decrypt_gcm(key, view[HEADER_6699_LEN + 12:total - 20],
+            view[HEADER_6699_LEN:HEADER_6699_LEN + 12], view[total - 20:total - 4],
+            view[4:HEADER_6699_LEN])
+        if retcode and len(payload) >= 4:
+            rc = _UINT32.unpack_from(payload)[0]
+            payload = payload[4:]
+        return Message(header.seqno, header.cmd, rc, payload, True, header.prefix)
+    end = total - (36 if key else 8)
+    start = HEADER_55AA_LEN + (4 if retcode else 0)
+    if end < start:
+        raise ProtocolError("Frame too short")
+    if retcode:
+        rc = _UINT32.unpack_from(view, HEADER_55AA_LEN)[0]
+    if key:
+        crc_good = hmac.compare_digest(hmac.new(key, view[:end], sha256).digest(), view[end:end + 32])
+    else:
+        crc_good = _UINT32.unpack_from(view, end)[0] == binascii.crc32(view[:end]) & 0xFFFFFFFF
+    return Message(header.seqno, header.cmd, rc, view[start:end], crc_good, header.prefix)
+
+
+class FrameParser(object):
+    """Split a TCP stream or UDP datagrams into frames without copying
+
+    Frames are found with the header length and returned as memoryview
+    slices of the received data.  The pieces of a frame split across recv()
+    calls are kept until the rest arrives and joined once.  Bytes before a
+    frame prefix (stream out of step) are skipped and counted.
+
+    Functions and Usage
+        parser = FrameParser()
+        for (frame, header) in parser.feed(data):
+            msg = unpack_message(frame, key, header)
+    """
+
+    def __init__(self):
+        # pieces of a frame split across recv() calls, joined once it is complete
+        self._parts = []
+        self._have = 0
+        self._need = 0
+        self.skipped = 0
+
+    def _sync(self, data, offset):
+        # offset of the next frame prefix after offset
+        found = [i for i in (data.find(PREFIX_55AA_BIN, offset + 1), data.find(PREFIX_6699_BIN, offset + 1)) if i >= 0]
+        # keep a possible partial prefix at the end
+        start = min(found) if found else max(offset + 1, len(data) - 3)
+        self.skipped += start - offset
+        return start
+
+    def feed(self, data):
+        """Frames completed by data (bytes received from the device)
+
+        Response :
+            List of (frame, header) for each complete frame - frame is a
+            memoryview and header the Header from parse_header()
+        """
+        if self._parts:
+            self._parts.append(data)
+            self._have += len(data)
+            if self._have < self._need:
+                return []
+            # bytes.join() takes no memoryview on python 2.7
+            data = bytearray()
+            for part in self._parts:
+                data += part
+            self._parts = []
+        view = memoryview(data)
+        size = len(data)
+        frames = []
+        offset = 0
+        while offset < size:
+            available = size - offset
+            if available < HEADER_6699_LEN:
+                head = data[offset:offset + 4]
+                if available < HEADER_55AA_LEN or head != PREFIX_55AA_BIN:
+                    if PREFIX_55AA_BIN.startswith(head) or PREFIX_6699_BIN.startswith(head):
+                        # wait for the rest of the header
+                        self._wait(view[offset:], available + 1)
+                        break
+                    offset = self._sync(data, offset)
+                    continue
+            try:
+                header = parse_header(data, offset)
+            except ProtocolError:
+                # not a frame (or out of step) - skip to the next prefix
+                offset = self._sync(data, offset)
+                continue
+            end = offset + header.total
+            if end > size:
+                self._wait(view[offset:], header.total)
+                break
+            frames.append((view[offset:end], header))
+            offset = end
+        return frames
+
+    def _wait(self, partial, need):
+        # keep the start of a frame until need bytes have arrived
+        self._parts = [partial]
+        self._have = len(partial)
+        self._need = need
+
+    def reset(self):
+        """Drop any partial frame, e.g. after reconnecting"""
+        self._parts = []
+
+
+class BroadcastDecoder(object):
+    """JSON payload of the UDP discovery broadcasts devices send
+
+    55AA frames carry plaintext JSON (3.1) or JSON encrypted with AES ECB
+    and the UDP key (3.2 - 3.4); 6699 frames (3.5) use AES GCM.  The CRC or
+    GCM tag is checked before anything is decrypted.
+
+    Functions and Usage
+        decoder = BroadcastDecoder(key)
+        payload = decoder.payload(data)
+    """
+
+    def __init__(self, key=UDPKEY):
+        self.key = key
+        # ECB keeps no state between blocks so one cipher serves every packet and thread
+        self._cipher = AES.new(key, AES.MODE_ECB)
+        # payloads are decrypted into a preallocated buffer for each thread
+        self._local = threading.local()
+
+    def _buffer(self, size):
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._local.buffer = memoryview(bytearray(MAX_PAYLOAD))
+        return buffer[:size]
+
+    def payload(self, data):
+        """JSON bytes of one broadcast datagram
+
+        55AA payloads are a memoryview of data (plaintext) or of this
+        thread's decrypt buffer, valid until the next call from the thread.
+        Raises ProtocolError if the frame or its checksum is not valid.
+        """
+        if len(data) < HEADER_55AA_LEN:
+            raise ProtocolError("Not enough data to unpack header")
+        (prefix, _, _, length) = _HEADER_55AA.unpack_from(data)
+        if prefix != PREFIX_55AA:
+            header = parse_header(data)
+            # the app pads some broadcasts with NUL bytes
+            payload = unpack_message(data, self.key, header, retcode=False).payload.rstrip(b"\x00")
+            if payload[:1] != b"{" and payload[4:5] == b"{":
+                # skip the return code
+                payload = memoryview(payload)[4:]
+            return payload
+        # return code, payload, CRC and suffix
+        end = HEADER_55AA_LEN + length - 8
+        if length > MAX_PAYLOAD or end < HEADER_55AA_LEN + 4 or len(data) < end + 8:
+            raise ProtocolError("Invalid frame length %d" % length)
+        view = memoryview(data)
+        if _UINT32.unpack_from(view, end)[0] != binascii.crc32(view[:end]) & 0xFFFFFFFF:
+            raise ProtocolError("Frame checksum mismatch")
+        payload = view[HEADER_55AA_LEN + 4:end]
+        if payload[:1] == b"{":
+            return payload
+        if len(payload) % 16:
+            raise ProtocolError("Invalid length %d for AES payload" % len(payload))
+        out = self._buffer(len(payload))
+        self._cipher.decrypt(payload, output=out)
+        n = bytearray(out[-1:])[0] if len(out) else 0
+        if n < 1 or n > 16:
+            raise ProtocolError("Invalid padding")
+        return out[:-n]
+
+
+class Session(object):
+    """Protocol state for one device connection
+
+    Holds the sequence number, the (negotiated) session key and the
+    device22 detection flag.  Create a new Session for each new TCP
+    connection.
+    """
+
+    def __init__(self, deviceid, key, vers):
+        self.id = deviceid
+        self.version = float(vers)
+        if not isinstance(key, bytes):
+            key = key.encode("latin1")
+        self.real_key = self.key = key
+        self.version_bytes = ("%.1f" % self.version).encode()
+        self.version_header = self.version_bytes + PROTOCOL_3x_HEADER
+        self.seqno = 1
+        self.local_nonce = None
+        # 3.2 devices and some 22 character ID devices need the device22 query
+        self.device22 = self.version == 3.2
+        # 3.4+ devices need a session key before any other command
+        self.established = self.version < 3.4
+
+    def _hmac_key(self):
+        return self.key if self.version >= 3.4 else None
+
+    def encode(self, cmd, payload):
+        """Encrypt payload (bytes) for cmd and return the complete frame"""
+        seqno = self.seqno
+        self.seqno += 1
+        if self.version >= 3.4:
+            if cmd not in NO_PROTOCOL_HEADER_CMDS:
+                payload = self.version_header + payload
+            if self.version >= 3.5:
+                return pack_message(seqno, cmd, payload, self.key, PREFIX_6699)
+            return pack_message(seqno, cmd, encrypt_ecb(self.key, payload), self.key)
+        if self.version >= 3.2:
+            payload = encrypt_ecb(self.key, payload)
+            if cmd not in NO_PROTOCOL_HEADER_CMDS:
+                payload = self.version_header + payload
+        elif cmd == CONTROL:
+            payload = base64.b64encode(encrypt_ecb(self.key, payload))
+            digest = md5(b"data=" + payload + b"||lpv=" + self.version_bytes + b"||" + self.key).hexdigest()
+            payload = self.version_bytes + digest[8:24].encode() + payload
+        return pack_message(seqno, cmd, payload)
+
+    def request(self, cmd, data):
+        """JSON encode data (dict) and return the frame for cmd"""
+        return self.encode(cmd, json.dumps(data, separators=(",", ":")).encode())
+
+    def status_request(self):
+        """Frame asking the device for the current value of its DPS"""
+        t = str(int(time.time()))
+        if self.device22:
+            dps = dict((dp, None) for dp in DEVICE22_DPS)
+            return self.request(CONTROL_NEW, {"devId": self.id, "uid": self.id, "t": t, "dps": dps})
+        if self.version >= 3.4:
+            return self.request(DP_QUERY_NEW, {})
+        return self.request(DP_QUERY, {"gwId": self.id, "devId": self.id, "uid": self.id, "t": t})
+
+    def heartbeat_request(self):
+        """Frame keeping the TCP connection open"""
+        return self.request(HEART_BEAT, {"gwId": self.id, "devId": self.id})
+
+    def updatedps_request(self, dps=UPDATE_DPS):
+        """Frame asking the device to push fresh values for dps"""
+        return self.request(UPDATEDPS, {"dpId": list(dps)})
+
+    def negotiate_start(self):
+        """First frame of the 3.4/3.5 session key negotiation"""
+        self.key = self.real_key
+        self.local_nonce = os.urandom(16)
+        return self.encode(SESS_KEY_NEG_START, self.local_nonce)
+
+    def negotiate_finish(self, msg):
+        """Check the device nonce response and return the final negotiation frame
+
+        The session key is switched in after the returned frame is built, so
+        every later encode/unpack uses it.
+        """
+        if msg.cmd != SESS_KEY_NEG_RESP:
+            raise ProtocolError("Session key negotiation returned command %d" % msg.cmd)
+        payload = msg.payload
+        if self.version < 3.5:
+            payload = decrypt_ecb(self.real_key, payload)
+        if len(payload) < 48:
+            raise ProtocolError("Session key negotiation response too short")
+        remote_nonce = payload[:16]
+        if hmac.new(self.real_key, self.local_nonce, sha256).digest() != payload[16:48]:
+            raise ProtocolError("Session key negotiation HMAC check failed")
+        frame = self.encode(SESS_KEY_NEG_FINISH, hmac.new(self.real_key, remote_nonce, sha256).digest())
+        xor = bytes(bytearray(a ^ b for (a, b) in zip(bytearray(self.local_nonce), bytearray(remote_nonce))))
+        if self.version < 3.5:
+            self.key = encrypt_ecb(self.real_key, xor, pad=False)
+        else:
+            self.key = encrypt_gcm(self.real_key, xor, self.local_nonce[:12])[0][:16]
+        self.established = True
+        return frame
+
+    def unpack(self, data, header=None):
+        """Unpack a frame received from the device"""
+        msg = unpack_message(data, self._hmac_key(), header)
+        if not msg.crc_good:
+            raise ProtocolError("Frame checksum mismatch")
+        return msg
+
+    def decode(self, msg):
+        """Decrypt and JSON decode a Message payload
+
+        Response :
+            Dictionary of the response (with "dps" lifted out of "data" for
+            3.4+ devices) or None for an empty acknowledgement.  None is also
+            returned when the device asks for the device22 query, in which
+            case session.device22 is set and the status request should be
+            sent again.
+        """
+        payload = msg.payload
+        if not payload:
+            return None
+        if self.version == 3.4:
+            payload = decrypt_ecb(self.key, payload)
+        if payload[:3] == b"3.1":
+            # encrypted 3.1 update: version, 16 bytes of MD5 hexdigest, base64 payload
+            payload = decrypt_ecb(self.key, base64.b64decode(payload[19:]))
+        elif self.version >= 3.2:
+            if payload[:3] == self.version_bytes or (self.device22 and len(payload) & 0x0F):
+                payload = payload[len(self.version_header):]
+            if self.version < 3.4:
+                payload = decrypt_ecb(self.key, payload)
+            if b"data unvalid" in payload and not self.device22:
+                self.device22 = True
+                return None
+        # plaintext 3.1 payloads are still a memoryview of the frame -
+        # tobytes() as bytes(memoryview) is its repr on python 2.7
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        payload = payload.rstrip(b"\x00")
+        if not payload.startswith(b"{"):
+            raise ProtocolError("Unexpected payload %r" % payload[:32])
+        try:
+            result = json.loads(payload.decode())
+        except ValueError:
+            raise ProtocolError("Invalid JSON payload")
+        if "dps" not in result and isinstance(result.get("data"), dict) and "dps" in result["data"]:
+            result["dps"] = result["data"]["dps"]
+        return result
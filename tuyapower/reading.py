@@ -0,0 +1,119 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Power reading result type
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ PowerReading holds one parsed response in a compact __slots__ object.  It
+ unpacks and indexes like the (on, w, mA, V, err) tuple returned by
+ deviceInfo() so existing callers keep working, and carries the raw
+ response and timestamp as attributes.
+
+ Status values are str based so they compare equal to the error strings
+ used before, e.g. reading.err == "OK".
+
+ Functions and Usage
+   reading = PowerReading(on, w, mA, V, err, raw, timestamp)
+   (on, w, mA, V, err) = reading
+   if reading.err is Status.OK: ...
+"""
+from collections import OrderedDict
+
+try:
+    from enum import Enum
+except ImportError:
+    # python 2.7 without enum34 - members are plain strings
+    Enum = object
+
+
+class Status(str, Enum):
+    """Result of a poll - compares equal to its message string"""
+    OK = "OK"
+    NO_POWER_DATA = "Power data unavailable"
+    MISSING_POWER_DATA = "Missing Power Data"
+    TIMEOUT = "Timeout polling device"
+    INCOMPLETE = "Incomplete response"
+    UNSUPPORTED = "Unsupported Version: Use tinytuya"
+    INTERRUPTED = "User Interrupt"
+    UNABLE = "Unable to poll"
+
+    # print the message, not Status.OK
+    __str__ = str.__str__
+    __format__ = str.__format__
+    __repr__ = str.__repr__
+
+
+class PowerReading(object):
+    """One parsed device response
+
+    Attributes :
+        on = Switch state - True/False or dictionary of states (multiswitch)
+        w = Wattage
+        mA = milliamps
+        V = Voltage
+        err = Status (OK when power data was found)
+        raw = Raw response from device (None if no response)
+        timestamp = Time of the response (seconds since epoch)
+    """
+    __slots__ = ("on", "w", "mA", "V", "err", "raw", "timestamp")
+    _fields = __slots__
+
+    def __init__(self, on, w, mA, V, err, raw=None, timestamp=None):
+        self.on = on
+        self.w = w
+        self.mA = mA
+        self.V = V
+        self.err = err
+        self.raw = raw
+        self.timestamp = timestamp
+
+    # tuple compatible - behaves like (on, w, mA, V, err)
+    def __iter__(self):
+        return iter((self.on, self.w, self.mA, self.V, self.err))
+
+    def __len__(self):
+        return 5
+
+    def __getitem__(self, index):
+        return (self.on, self.w, self.mA, self.V, self.err)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, PowerReading):
+            return all(getattr(self, f) == getattr(other, f) for f in self._fields)
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "PowerReading(%s)" % ", ".join(
+            "%s=%r" % (f, getattr(self, f)) for f in self._fields)
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __setstate__(self, state):
+        for (f, value) in zip(self._fields, state):
+            setattr(self, f, value)
+
+    @property
+    def switches(self):
+        """Switch states as a dictionary for single and multiswitch devices"""
+        if isinstance(self.on, dict):
+            return self.on
+        return {"1": self.on}
+
+    def _asdict(self):
+        return OrderedDict((f, getattr(self, f)) for f in self._fields)
+
+    def _replace(self, **kwargs):
+        values = self._asdict()
+        values.update(kwargs)
+        return PowerReading(**values)
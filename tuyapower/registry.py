@@ -0,0 +1,213 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Always-on registry of Tuya devices discovered from their UDP broadcasts
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ A background thread keeps listening on UDP 6666 and 6667 and maintains
+ live indexes from device ID to (ip, version, last_seen) and from IP to
+ device ID.  Callbacks fire when a device appears, moves to a new IP
+ address (DHCP lease change) or stops broadcasting.
+
+ Functions and Usage
+   registry = tuyapower.DeviceRegistry(on_new=func, on_move=func, on_silent=func)
+   registry.start()
+   registry.wait(ids, timeout)
+   entry = registry.get(id)
+   (ip, vers) = registry.lookup(id)
+   id = registry.byip(ip)
+   registry.stop()
+"""
+import logging
+import select
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import tuyapower
+
+log = logging.getLogger(__name__)
+
+SILENCE = 30.0      # Seconds without a broadcast before a device is reported silent
+
+# gwId, ip, version and last_seen from the latest broadcast, online is False once silent
+RegistryEntry = namedtuple("RegistryEntry", "gwId ip version last_seen online info")
+
+
+class DeviceRegistry(object):
+    """Live index of devices on the network built from their broadcasts
+
+    Parameters :
+        ports = List of UDP ports to listen on (default 6666 and 6667)
+        silence = Seconds without a broadcast before on_silent fires
+        on_new = Optional function(entry) called when a device is first seen
+                 or broadcasts again from the same IP after going silent
+        on_move = Optional function(entry, oldip) called when a device
+                  broadcasts from a new IP address
+        on_silent = Optional function(entry) called when a device stops
+                    broadcasting
+
+    Callbacks run on the listener thread and should return quickly.
+    """
+
+    def __init__(self, ports=None, silence=SILENCE, on_new=None, on_move=None, on_silent=None):
+        if ports is None:
+            ports = [tuyapower.UDPPORT, tuyapower.UDPPORTS]
+        self.ports = list(ports)
+        self.silence = silence
+        self.on_new = on_new
+        self.on_move = on_move
+        self.on_silent = on_silent
+        self._devices = {}
+        self._ips = {}
+        self._changed = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, deviceid):
+        return deviceid in self._devices
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Open the UDP ports and start the listener thread"""
+        if self._thread is not None:
+            return self
+        socks = []
+        try:
+            for port in self.ports:
+                sock = tuyapower._udpsocket(port)
+                sock.setblocking(False)
+                socks.append(sock)
+        except Exception:
+            for sock in socks:
+                sock.close()
+            raise
+        self._running = True
+        self._thread = threading.Thread(target=self._listen, args=(socks,), name="tuyapower-registry")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the listener thread and close the UDP ports"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get(self, deviceid):
+        """RegistryEntry for a device ID or None if it has not been seen"""
+        return self._devices.get(deviceid)
+
+    def lookup(self, deviceid):
+        """(ip, version) for a device ID or (None, None) if it has not been seen"""
+        entry = self._devices.get(deviceid)
+        if entry is None:
+            return (None, None)
+        return (entry.ip, entry.version)
+
+    def byip(self, ip):
+        """Device ID broadcasting from an IP address or None"""
+        return self._ips.get(ip)
+
+    def entries(self):
+        """List of all RegistryEntry seen so far"""
+        return list(self._devices.values())
+
+    def devices(self):
+        """Dictionary of broadcast data keyed by IP - same as deviceScan()"""
+        return dict((e.ip, e.info) for e in self._devices.values())
+
+    def wait(self, deviceids=None, timeout=None):
+        """Block until every device ID has been seen (or any device if None)
+
+        Response :
+            True if all devices were seen, False on timeout
+        """
+        deviceids = list(deviceids or [])
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while True:
+                if deviceids:
+                    if all(i in self._devices for i in deviceids):
+                        return True
+                elif self._devices:
+                    return True
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self._changed.wait(wait)
+
+    def update(self, data, ip):
+        """Record one raw broadcast packet received from ip"""
+        (result, note) = tuyapower._decodeBroadcast(data, ip)
+        if note != "Valid":
+            return None
+        now = time.time()
+        deviceid = result["gwId"]
+        with self._changed:
+            old = self._devices.get(deviceid)
+            entry = RegistryEntry(deviceid, result["ip"], result["version"], now, True, result)
+            self._devices[deviceid] = entry
+            if old is not None and old.ip != entry.ip and self._ips.get(old.ip) == deviceid:
+                del self._ips[old.ip]
+            self._ips[entry.ip] = deviceid
+            self._changed.notify_all()
+        if old is None:
+            self._callback(self.on_new, entry)
+        elif old.ip != entry.ip:
+            # usually a DHCP lease change, often after a silent reboot
+            log.info("Device %s moved from %s to %s" % (deviceid, old.ip, entry.ip))
+            self._callback(self.on_move, entry, old.ip)
+        elif not old.online:
+            self._callback(self.on_new, entry)
+        return entry
+
+    def _expire(self, now):
+        # flag devices that have not broadcast for silence seconds
+        silent = []
+        with self._changed:
+            for (deviceid, entry) in list(self._devices.items()):
+                if entry.online and now - entry.last_seen > self.silence:
+                    entry = entry._replace(online=False)
+                    self._devices[deviceid] = entry
+                    silent.append(entry)
+        for entry in silent:
+            log.info("Device %s [%s] is silent" % (entry.gwId, entry.ip))
+            self._callback(self.on_silent, entry)
+
+    def _callback(self, func, *args):
+        if func is None:
+            return
+        try:
+            func(*args)
+        except Exception:
+            log.exception("DeviceRegistry callback failed")
+
+    def _listen(self, socks):
+        try:
+            while self._running:
+                ready = select.select(socks, [], [], min(1.0, self.silence / 2.0))[0]
+                for sock in ready:
+                    # drain everything queued on this port
+                    while True:
+                        try:
+                            (data, addr) = sock.recvfrom(4048)
+                        except socket.error:
+                            break
+                        self.update(data, addr[0])
+                self._expire(time.time())
+        finally:
+            for sock in socks:
+                sock.close()
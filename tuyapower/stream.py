@@ -0,0 +1,111 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Continuous monitoring of a Tuya WiFi smart device over one persistent connection
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ Functions and Usage
+   for status in tuyapower.monitor(id, ip, key, vers, interval):
+       print(status.timestamp, status.w)
+
+ Instead of re-polling, monitor() keeps the connection open and yields a
+ reading each time the device pushes a DPS update.  Every interval seconds
+ it sends a heartbeat (to keep the connection alive) and asks the device to
+ refresh its power DPS.
+"""
+from __future__ import print_function   # python 2.7 support
+import logging
+import time
+
+import tuyapower
+from .protocol import UPDATE_DPS
+from .reading import PowerReading, Status
+
+log = logging.getLogger(__name__)
+
+MONITORINTERVAL = 5.0   # Seconds between heartbeat and DPS update requests
+RECONNECTDELAY = 2.0    # Seconds to wait before reconnecting a dropped connection
+
+
+def _reading(state, data):
+    # parse the merged DPS state - data is the response that changed it
+    try:
+        (sw, w, mA, V, err) = tuyapower._parsedps(state)
+    except Exception:
+        (sw, w, mA, V) = tuyapower._DEFAULTS
+        err = Status.MISSING_POWER_DATA
+    return PowerReading(sw, w, mA, V, err, data, time.time())
+
+
+def _poll(deviceid, ip, key, vers, interval):
+    # fallback for backends without persistent sockets (pytuya)
+    while True:
+        start = time.time()
+        yield tuyapower.deviceStatus(deviceid, ip, key, vers)
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+# for status in tuyapower.monitor(id, ip, key, vers):
+def monitor(deviceid, ip, key, vers, interval=MONITORINTERVAL):
+    """Stream readings from a device over one persistent connection
+       for status in tuyapower.monitor(id, ip, key, vers, interval):
+
+    Parameters :
+        id = Device ID e.g. 01234567891234567890
+        ip = Device IP Address e.g. 10.0.1.99
+        key = Device Key e.g. 0123456789abcdef
+        vers = Version of Protocol 3.1, 3.2, 3.3, 3.4 and 3.5
+        interval = Seconds between heartbeat / DPS update requests
+
+    Response :
+        Generator of PowerReading (on, w, mA, V, err, raw, timestamp), one
+        for the initial status and one for every update the device pushes.
+        raw is the response as received (updates only carry changed DPS);
+        on, w, mA and V are parsed from all DPS seen so far.
+    """
+    backend = tuyapower.backend
+    if not backend.persistent:
+        for status in _poll(deviceid, ip, key, vers, interval):
+            yield status
+        return
+
+    d = tuyapower._newDevice(deviceid, ip, key, vers)
+    state = {}
+    try:
+        while True:
+            # (re)connect and fetch full status
+            data = d.status()
+            if not data or "dps" not in data:
+                log.info("Unable to reach plug %s [%s] - reconnecting." % (deviceid, ip))
+                d.close()
+                yield PowerReading(False, 0, 0, 0, Status.TIMEOUT, data, time.time())
+                time.sleep(RECONNECTDELAY)
+                continue
+            state.update(data["dps"])
+            yield _reading(state, data)
+
+            due = time.time() + interval
+            while d.socket is not None:
+                now = time.time()
+                if now >= due:
+                    # keep connection alive and ask for fresh power data
+                    backend.refresh(d, UPDATE_DPS)
+                    due = now + interval
+                    continue
+                # wait for the device to push something
+                if not backend.ready(d, due - now):
+                    continue
+                data = backend.receive(d)
+                if not data:
+                    # heartbeat or update acknowledgement
+                    continue
+                if "dps" in data:
+                    state.update(data["dps"])
+                    yield _reading(state, data)
+                elif "Err" in data:
+                    log.info("Connection to plug %s [%s] lost: %s" % (deviceid, ip, data.get("Error")))
+                    d.close()
+    finally:
+        d.close()
@@ -0,0 +1,77 @@
+# TuyaPower Module
+# -*- coding: utf-8 -*-
+"""
+ Poll a whole fleet of Tuya WiFi smart devices from the command line
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/tuyapower
+
+ One process polls every device in a devices.json file concurrently and
+ writes a table, JSON lines or CSV - a cron job sweeping hundreds of plugs
+ starts one interpreter instead of one per plug.
+
+ Functions and Usage
+   python -m tuyapower poll devices.json --workers 32 --format table|jsonl|csv
+   python -m tuyapower poll devices.json --scan
+"""
+from __future__ import print_function   # python 2.7 support
+import argparse
+import sys
+
+import tuyapower
+from .export import CSVWriter
+from .fleet import Fleet
+from .reading import Status
+
+FORMATS = ("table", "jsonl", "csv")
+
+
+def _state(on):
+    if isinstance(on, dict):
+        return " ".join("%s:%s" % (k, "On" if v else "Off") for (k, v) in sorted(on.items()))
+    return "On" if on else "Off"
+
+
+def _table(fleet, results, out):
+    rows = [("Name", "ID", "IP", "State", "W", "mA", "V", "Status")]
+    for (deviceid, (on, w, mA, V, err)) in sorted(results, key=lambda r: (fleet.get(r[0]).name or "", r[0])):
+        device = fleet.get(deviceid)
+        power = ("%s" % w, "%s" % mA, "%s" % V) if err == Status.OK else ("", "", "")
+        rows.append((device.name or "", deviceid, device.ip, _state(on)) + power + (str(err),))
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        out.write("  ".join(c.ljust(w) for (c, w) in zip(row, widths)).rstrip() + "\n")
+
+
+def main(argv=None):
+    """python -m tuyapower poll - command line entry point"""
+    parser = argparse.ArgumentParser(prog="python -m tuyapower poll",
+        description="Poll every device in a devices.json file")
+    parser.add_argument("devices", nargs="?", default="devices.json",
+        help="devices.json with id, key and optional ip, version and name (default devices.json)")
+    parser.add_argument("--workers", type=int, default=tuyapower.MAXWORKERS,
+        help="Devices polled at the same time (default %d)" % tuyapower.MAXWORKERS)
+    parser.add_argument("--format", choices=FORMATS, default="table", help="Output format (default table)")
+    parser.add_argument("--scan", action="store_true",
+        help="Scan for devices without an IP address or version in the devices file")
+    parser.add_argument("--idle", type=float, default=tuyapower.SCANIDLE,
+        help="Seconds without a new device before the scan stops (default %s)" % tuyapower.SCANIDLE)
+    args = parser.parse_args(argv)
+
+    fleet = Fleet.load(args.devices)
+    if args.scan and fleet.missing():
+        fleet.join(tuyapower.deviceScan(False, idle=args.idle))
+    missing = fleet.missing()
+    if missing:
+        print("No IP address or version for %d devices: %s" % (len(missing), ", ".join(
+            d.name or d.id for d in missing)), file=sys.stderr)
+
+    out = sys.stdout
+    if args.format == "jsonl":
+        for line in tuyapower.devicesJSONLines(fleet.targets(), args.workers):
+            out.write(line)
+    elif args.format == "csv":
+        with CSVWriter(stream=out) as writer:
+            writer.extend(tuyapower.deviceInfoIter(fleet.targets(), args.workers))
+    else:
+        _table(fleet, list(tuyapower.deviceInfoIter(fleet.targets(), args.workers)), out)